@@ -0,0 +1,576 @@
+"""
+Finite automata construction for the scanner.
+
+Every token, given either as a regular expression or as a graph dfa, is
+folded into a single nondeterministic automaton (Thompson construction),
+determinized with the subset construction and then minimized with
+Hopcroft's algorithm. Accepting states are tagged with the token of
+the highest priority (lowest index) definition they came from, so a
+single pass over the input recognizes any token.
+"""
+
+import array
+import collections
+import marshal
+
+import cache
+
+
+ERROR = -1 #error state and "no token" marker in the dense tables
+
+ScannerTables = collections.namedtuple("ScannerTables", ["classifier",
+                    "transition", "accept", "tokens", "num_classes"])
+"""
+classifier - array('B') mapping every byte to its character class
+transition - flat array('i') of num_states * num_classes, the next state
+             for (state, class) lives at state * num_classes + class
+accept - array('i') holding the index into tokens for accepting states,
+         ERROR otherwise
+tokens - token types
+num_classes - number of character classes, class 0 never transitions
+"""
+
+VERSION = 1 #bump when the table layout changes, invalidates cached tables
+CACHE_DIR = cache.DEFAULT_DIR #default directory for cached tables
+PREBUILT = "scanner_tables" #generated module, see write_module
+_TABLE_CACHE = {} #tuple(spec) -> ScannerTables
+_DEFAULT = object() #compile_spec argument for CACHE_DIR at call time
+
+
+class NFA(object):
+    """
+    Nondeterministic finite automaton with epsilon moves.
+    States are consecutive integers starting at 0.
+    """
+    def __init__(self):
+        self.edges = []     #state -> {char: [states]}
+        self.epsilon = []   #state -> [states]
+        self.accept = {}    #state -> (priority, token)
+
+    def add_state(self):
+        """
+        Add a new state and return its number
+        """
+        self.edges.append({})
+        self.epsilon.append([])
+        return len(self.edges) - 1
+
+    def add_edge(self, start, end, chars):
+        """
+        Add a transition from start to end on every character in chars
+        """
+        edges = self.edges[start]
+        for char in chars:
+            edges.setdefault(char, []).append(end)
+
+    def add_epsilon(self, start, end):
+        """
+        Add an epsilon transition from start to end
+        """
+        self.epsilon[start].append(end)
+
+    def closure(self, states):
+        """
+        Epsilon closure of a set of states
+        @return:
+        frozenset of reachable states
+        """
+        result = set(states)
+        stack = list(states)
+        while stack:
+            state = stack.pop()
+            for h in self.epsilon[state]:
+                if h not in result:
+                    result.add(h)
+                    stack.append(h)
+        return frozenset(result)
+
+
+def add_graph(nfa, g, token, priority, startnode = 0):
+    """
+    Copy a graph.Graph dfa into the nfa
+    @param:
+    nfa - target automaton
+    g - dfa graph, terminal nodes have the attribute "T"
+    token - token type reported by the terminal nodes
+    priority - lower values win when several tokens accept the same lexeme
+    @return:
+    start state of the copy inside the nfa
+    """
+    mapping = {startnode: nfa.add_state()}
+    Q = collections.deque([startnode])
+    while Q:
+        node = Q.popleft()
+        if g.get_node_attr(node) == "T":
+            nfa.accept[mapping[node]] = (priority, token)
+        for h in g[node]:
+            if h not in mapping:
+                mapping[h] = nfa.add_state()
+                Q.append(h)
+            nfa.add_edge(mapping[node], mapping[h], g.get_edge_attr(node, h))
+    return mapping[startnode]
+
+
+class RegexError(Exception):
+    """
+    Raised for malformed token regular expressions
+    """
+    pass
+
+
+class RegexParser(object):
+    """
+    Thompson construction for a small regular expression language:
+    literals, '.', [classes] with ranges and '^' negation, groups,
+    alternation and the '*', '+' and '?' operators.
+    Escapes: \\n \\t \\r \\d \\w \\s, any other escaped character is literal.
+    """
+    ESCAPES = {"n": "\n", "t": "\t", "r": "\r",
+               "d": "0123456789",
+               "w": "abcdefghijklmnopqrstuvwxyz"
+                    "ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_",
+               "s": " \t\r\n\f\v"}
+    ANY = "".join(chr(c) for c in xrange(256) if chr(c) != "\n")
+
+    def __init__(self, nfa, regex):
+        self.nfa = nfa
+        self.regex = regex
+        self.cursor = 0
+
+    def parse(self):
+        """
+        Build the automaton
+        @return:
+        (start, end) states of the fragment inside the nfa
+        """
+        fragment = self.alternation()
+        if self.cursor < len(self.regex):
+            self.error("unexpected '" + self.regex[self.cursor] + "'")
+        return fragment
+
+    def error(self, msg):
+        raise RegexError("{0} at {1} in {2!r}".format(msg, self.cursor,
+                                                       self.regex))
+
+    def peek(self):
+        if self.cursor < len(self.regex):
+            return self.regex[self.cursor]
+        return None
+
+    def next_char(self):
+        if self.cursor >= len(self.regex):
+            self.error("unexpected end")
+        char = self.regex[self.cursor]
+        self.cursor += 1
+        return char
+
+    def alternation(self):
+        """
+        alternation -> concatenation ('|' concatenation)*
+        """
+        fragments = [self.concatenation()]
+        while self.peek() == "|":
+            self.cursor += 1
+            fragments.append(self.concatenation())
+        if len(fragments) == 1:
+            return fragments[0]
+        start, end = self.nfa.add_state(), self.nfa.add_state()
+        for f_start, f_end in fragments:
+            self.nfa.add_epsilon(start, f_start)
+            self.nfa.add_epsilon(f_end, end)
+        return start, end
+
+    def concatenation(self):
+        """
+        concatenation -> repetition*
+        """
+        start = end = self.nfa.add_state()
+        while self.peek() not in (None, "|", ")"):
+            f_start, f_end = self.repetition()
+            self.nfa.add_epsilon(end, f_start)
+            end = f_end
+        return start, end
+
+    def repetition(self):
+        """
+        repetition -> atom ('*' | '+' | '?')*
+        """
+        f_start, f_end = self.atom()
+        while self.peek() in ("*", "+", "?"):
+            op = self.next_char()
+            start, end = self.nfa.add_state(), self.nfa.add_state()
+            self.nfa.add_epsilon(start, f_start)
+            self.nfa.add_epsilon(f_end, end)
+            if op != "+":
+                self.nfa.add_epsilon(start, end)
+            if op != "?":
+                self.nfa.add_epsilon(f_end, f_start)
+            f_start, f_end = start, end
+        return f_start, f_end
+
+    def atom(self):
+        """
+        atom -> '(' alternation ')' | '[' class ']' | '.' | character
+        """
+        char = self.next_char()
+        if char == "(":
+            fragment = self.alternation()
+            if self.peek() != ")":
+                self.error("missing ')'")
+            self.cursor += 1
+            return fragment
+        if char in ("*", "+", "?"):
+            self.error("nothing to repeat")
+        if char == "[":
+            chars = self.char_class()
+        elif char == ".":
+            chars = self.ANY
+        elif char == "\\":
+            char = self.next_char()
+            chars = self.ESCAPES.get(char, char)
+        else:
+            chars = char
+        start, end = self.nfa.add_state(), self.nfa.add_state()
+        self.nfa.add_edge(start, end, chars)
+        return start, end
+
+    def char_class(self):
+        """
+        Characters of a [...] class, the opening bracket is consumed
+        """
+        negate = self.peek() == "^"
+        if negate:
+            self.cursor += 1
+        chars = set()
+        first = True
+        while first or self.peek() != "]":
+            first = False
+            char = self.next_char()
+            if char == "\\":
+                char = self.next_char()
+                chars.update(self.ESCAPES.get(char, char))
+                continue
+            if self.peek() == "-" and self.regex[self.cursor + 1:self.cursor + 2] not in ("", "]"):
+                self.cursor += 1
+                last = self.next_char()
+                if ord(last) < ord(char):
+                    self.error("bad range")
+                chars.update(chr(c) for c in xrange(ord(char), ord(last) + 1))
+            else:
+                chars.add(char)
+        self.cursor += 1
+        if negate:
+            chars = set(chr(c) for c in xrange(256)) - chars
+        return "".join(sorted(chars))
+
+
+def add_regex(nfa, regex, token, priority):
+    """
+    Add a regular expression to the nfa
+    @param:
+    nfa - target automaton
+    regex - token definition, see RegexParser
+    token - token type reported when the regex matches
+    priority - lower values win when several tokens accept the same lexeme
+    @return:
+    start state of the regex inside the nfa
+    """
+    start, end = RegexParser(nfa, regex).parse()
+    nfa.accept[end] = (priority, token)
+    return start
+
+
+def subset_construction(nfa, starts):
+    """
+    Determinize the nfa
+    @param:
+    nfa - automaton to determinize
+    starts - start states of the nfa
+    @return:
+    transitions - list of {char: state}, state 0 is the start state
+    accept - list of token type or None for every state
+    """
+    start = nfa.closure(starts)
+    index = {start: 0}
+    subsets = [start]
+    transitions = []
+    accept = []
+    i = 0
+    while i < len(subsets):
+        subset = subsets[i]
+        i += 1
+        tagged = [nfa.accept[s] for s in subset if s in nfa.accept]
+        accept.append(min(tagged)[1] if tagged else None)
+
+        moves = collections.defaultdict(set)
+        for s in subset:
+            for char, ends in nfa.edges[s].iteritems():
+                moves[char].update(ends)
+        row = {}
+        for char, ends in moves.iteritems():
+            target = nfa.closure(ends)
+            if target not in index:
+                index[target] = len(subsets)
+                subsets.append(target)
+            row[char] = index[target]
+        transitions.append(row)
+    return transitions, accept
+
+
+def minimize(transitions, accept):
+    """
+    Hopcroft's partition refinement.
+    States that accept different tokens are never merged.
+    @param:
+    transitions - list of {char: state}
+    accept - list of token type or None
+    @return:
+    minimized (transitions, accept) with the start state renumbered to 0
+    """
+    size = len(transitions)
+    dead = size #implicit sink for missing transitions
+    alphabet = set()
+    for row in transitions:
+        alphabet.update(row)
+
+    inverse = dict((char, collections.defaultdict(set)) for char in alphabet)
+    for state, row in enumerate(transitions):
+        for char in alphabet:
+            inverse[char][row.get(char, dead)].add(state)
+    for char in alphabet:
+        inverse[char][dead].add(dead)
+
+    #initial partition: one block per token type, non accepting + sink
+    groups = collections.defaultdict(set)
+    for state, token in enumerate(accept):
+        groups[token].add(state)
+    groups[None].add(dead)
+    blocks = groups.values()
+    block_of = [0] * (size + 1)
+    for b, block in enumerate(blocks):
+        for state in block:
+            block_of[state] = b
+
+    W = set(xrange(len(blocks)))
+    while W:
+        splitter = blocks[W.pop()]
+        for char in alphabet:
+            X = set()
+            for state in splitter:
+                X.update(inverse[char].get(state, ()))
+            touched = collections.defaultdict(set)
+            for state in X:
+                touched[block_of[state]].add(state)
+            for b, inside in touched.iteritems():
+                if len(inside) == len(blocks[b]):
+                    continue
+                outside = blocks[b] - inside
+                blocks[b] = inside
+                blocks.append(outside)
+                new = len(blocks) - 1
+                for state in outside:
+                    block_of[state] = new
+                if b in W or len(outside) <= len(inside):
+                    W.add(new)
+                else:
+                    W.add(b)
+
+    #renumber blocks in breadth first order from the start state
+    number = {block_of[0]: 0}
+    order = [block_of[0]]
+    min_transitions = []
+    min_accept = []
+    i = 0
+    while i < len(order):
+        b = order[i]
+        i += 1
+        state = min(blocks[b]) #never the sink, it has the largest number
+        min_accept.append(accept[state])
+        row = {}
+        for char, target in sorted(transitions[state].iteritems()):
+            tb = block_of[target]
+            if tb == block_of[dead]:
+                continue
+            if tb not in number:
+                number[tb] = len(order)
+                order.append(tb)
+            row[char] = number[tb]
+        min_transitions.append(row)
+    return min_transitions, min_accept
+
+
+def gen_tables(transitions, accept):
+    """
+    Build dense scanner tables from a dfa.
+    Characters with identical transitions share a class, class 0 holds
+    every byte without a transition.
+    @return:
+    ScannerTables
+    """
+    signatures = collections.defaultdict(list)
+    alphabet = set()
+    for row in transitions:
+        alphabet.update(row)
+    for char in sorted(alphabet):
+        signature = tuple(row.get(char, ERROR) for row in transitions)
+        signatures[signature].append(char)
+    signatures.pop(tuple([ERROR] * len(transitions)), None)
+
+    classes = sorted(signatures, key = lambda s: signatures[s][0])
+    num_classes = len(classes) + 1
+    classifier = array.array("B", [0] * 256)
+    transition = array.array("i", [ERROR] * (len(transitions) * num_classes))
+    for cat, signature in enumerate(classes, 1):
+        for char in signatures[signature]:
+            classifier[ord(char)] = cat
+        for state, target in enumerate(signature):
+            transition[state * num_classes + cat] = target
+
+    tokens = []
+    for token in accept:
+        if token is not None and token not in tokens:
+            tokens.append(token)
+    table_accept = array.array("i", [ERROR if token is None else
+                                     tokens.index(token) for token in accept])
+    return ScannerTables(classifier, transition, table_accept, tuple(tokens),
+                         num_classes)
+
+
+def merge(dfa_list):
+    """
+    Combine token dfas into one minimized dfa
+    @param:
+    dfa_list - list of (token type, graph.Graph), earlier entries have
+               priority when two tokens match the same lexeme
+    @return:
+    ScannerTables
+    """
+    return _build((), dfa_list)
+
+
+def compile_spec(spec, dfa_list = (), cache_dir = _DEFAULT):
+    """
+    Turn token definitions into scanner tables.
+    Tables for a spec are cached in memory and, when cache_dir is set,
+    on disk under the hash of the spec as marshaled strings rather than
+    pickles, see cache.TableCache. Tables for
+    the spec of the prebuilt module are loaded from it.
+    @param:
+    spec - list of (token type, regex), earlier entries have priority
+    dfa_list - additional (token type, graph.Graph) entries with lower
+               priority than the spec, disables caching
+    cache_dir - directory for cached tables, None to skip the disk,
+                CACHE_DIR by default
+    @return:
+    ScannerTables
+    """
+    if dfa_list:
+        return _build(spec, dfa_list)
+    spec = tuple(spec)
+    tables = _TABLE_CACHE.get(spec)
+    if tables is not None:
+        return tables
+
+    tables = _prebuilt(spec)
+    if tables is None:
+        if cache_dir is _DEFAULT:
+            cache_dir = CACHE_DIR
+        disk = cache.TableCache(cache_dir) if cache_dir is not None else None
+        digest = cache.TableCache.key("scanner", repr((VERSION, list(spec))))
+        tables = _loads(disk.get_raw(digest)) if disk is not None else None
+        if tables is None:
+            tables = _build(spec, dfa_list)
+            if disk is not None:
+                disk.put_raw(digest, _dumps(tables))
+    _TABLE_CACHE[spec] = tables
+    return tables
+
+
+def _dumps(tables):
+    """
+    Tables as a marshaled tuple of strings and ints
+    """
+    return marshal.dumps((tables.classifier.tostring(),
+                          tables.transition.tostring(),
+                          tables.accept.tostring(),
+                          tables.tokens, tables.num_classes))
+
+
+def _loads(data):
+    """
+    Inverse of _dumps, None for missing or corrupt data
+    """
+    if data is None:
+        return None
+    try:
+        classifier, transition, accept, tokens, num_classes = \
+                marshal.loads(data)
+        return ScannerTables(array.array("B", classifier),
+                             array.array("i", transition),
+                             array.array("i", accept), tuple(tokens),
+                             num_classes)
+    except (EOFError, ValueError, TypeError):
+        return None
+
+
+def _prebuilt(spec):
+    """
+    Tables from the prebuilt module, None if it is missing or was
+    generated from another spec or table version
+    """
+    try:
+        prebuilt = __import__(PREBUILT)
+    except ImportError:
+        return None
+    if prebuilt.VERSION != VERSION or prebuilt.SPEC != spec:
+        return None
+    return ScannerTables(array.array("B", prebuilt.CLASSIFIER),
+                         array.array("i", prebuilt.TRANSITION),
+                         array.array("i", prebuilt.ACCEPT),
+                         prebuilt.TOKENS, prebuilt.NUM_CLASSES)
+
+
+def write_module(spec, fh):
+    """
+    Write python source holding the tables of spec, load it by saving
+    it as <PREBUILT>.py next to this file
+    """
+    tables = _build(tuple(spec), ())
+    fh.write('"""\n'
+             'Prebuilt scanner tables for compiler.Scanner, generated by\n'
+             'automata.write_module. Do not edit, run python automata.py\n'
+             'after changing the token spec.\n'
+             '"""\n\n')
+    fh.write("VERSION = {0!r}\n".format(VERSION))
+    fh.write("SPEC = {0!r}\n".format(tuple(spec)))
+    fh.write("CLASSIFIER = {0!r}\n".format(tables.classifier.tostring()))
+    for name, values in (("TRANSITION", tables.transition),
+                         ("ACCEPT", tables.accept)):
+        fh.write("{0} = (\n".format(name))
+        for i in xrange(0, len(values), 16):
+            fh.write("    " + ", ".join(str(v) for v in values[i:i + 16]) +
+                     ",\n")
+        fh.write(")\n")
+    fh.write("TOKENS = {0!r}\n".format(tables.tokens))
+    fh.write("NUM_CLASSES = {0!r}\n".format(tables.num_classes))
+
+
+def _build(spec, dfa_list):
+    nfa = NFA()
+    starts = [add_regex(nfa, regex, token, priority)
+                for priority, (token, regex) in enumerate(spec)]
+    starts += [add_graph(nfa, dfa, token, priority)
+                for priority, (token, dfa) in enumerate(dfa_list, len(spec))]
+    transitions, accept = subset_construction(nfa, starts)
+    return gen_tables(*minimize(transitions, accept))
+
+
+if __name__ == "__main__":
+    #regenerate the prebuilt tables of the bnf scanner
+    import os
+    import compiler
+    spec = compiler.Scanner(os.devnull)._token_spec()
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        PREBUILT + ".py")
+    with open(path, "w") as fh:
+        write_module(spec, fh)
@@ -0,0 +1,192 @@
+#!/usr/bin/env python2.7
+"""
+Build LL(1) tables for many grammar files on a pool of processes.
+
+The scanner tables and the table of the bnf meta grammar are built once
+in the parent before the pool forks, workers inherit them. Workers
+return tables in their binary form, the parent collects them and writes
+every output file with a single write.
+"""
+
+
+import argparse
+import collections
+import glob
+import multiprocessing
+import os
+import StringIO
+import sys
+
+import compiler
+import simplelog
+import table_generator
+
+
+p = argparse.ArgumentParser(description = "build tables for many grammars",
+                            formatter_class = argparse.ArgumentDefaultsHelpFormatter)
+p.add_argument('grammars', nargs = '+', help = "grammar files or glob patterns")
+p.add_argument('-o', '--output', default = ".",
+                help = "directory for the <grammar>.ll1 tables")
+p.add_argument('-j', '--jobs', type = int, default = None,
+                help = "worker processes, default one per cpu")
+
+SUFFIX = ".ll1"
+
+BuildResult = collections.namedtuple("BuildResult", ["path", "table",
+                                     "conflicts", "error"])
+"""
+path - grammar file
+table - ParseTable.dump output, None on error
+conflicts - ParseTable.report_conflicts output
+error - error message, None on success
+"""
+
+
+def expand(patterns):
+    """
+    Grammar paths for a list of file names and glob patterns, in order
+    and without duplicates
+    @raise:
+    ValueError naming every pattern that matches no file
+    """
+    paths = []
+    seen = set()
+    unmatched = []
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            matches = sorted(glob.glob(pattern))
+            if not matches:
+                unmatched.append(pattern)
+        else:
+            matches = [pattern]
+        for path in matches:
+            if path not in seen:
+                seen.add(path)
+                paths.append(path)
+    if unmatched:
+        raise ValueError("no grammar matches {0}".format(
+                            ", ".join(unmatched)))
+    return paths
+
+
+def build_one(path, text = None):
+    """
+    Build the tables of one grammar, errors are returned rather than
+    raised so one bad grammar doesn't stop the batch
+    @param:
+    text - grammar text, see table_generator.build
+    @return:
+    BuildResult
+    """
+    try:
+        generator = table_generator.build(path, text)
+    except (compiler.ParseError, EnvironmentError) as err:
+        return BuildResult(path, None, [], "{0}: {1}".format(
+                                               type(err).__name__, err))
+    data = StringIO.StringIO()
+    generator.TABLE.dump(data)
+    return BuildResult(path, data.getvalue(),
+                       generator.TABLE.report_conflicts(), None)
+
+
+def _init_worker():
+    """
+    Worker setup, logging from many processes to one file is of no use
+    """
+    simplelog.sl.disable()
+
+
+def prepare():
+    """
+    Build the tables every grammar needs once, before workers fork.
+    Generating the bnf table runs the scanner, which compiles and caches
+    the scanner tables.
+    """
+    table_generator.bnf_table()
+
+
+def build_all(paths, jobs = None):
+    """
+    Build tables for every grammar
+    @param:
+    paths - grammar files
+    jobs - worker processes, None for one per cpu, 1 builds in this
+           process
+    @return:
+    list of BuildResult in the order of paths
+    """
+    if not paths:
+        return []
+    prepare()
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    jobs = min(jobs, len(paths))
+    if jobs <= 1:
+        return [build_one(path) for path in paths]
+    pool = multiprocessing.Pool(jobs, _init_worker)
+    try:
+        #a few grammars per task keeps the pipes quiet, several tasks
+        #per worker keep the load balanced
+        chunksize = max(1, len(paths) // (jobs * 4))
+        return pool.map(build_one, paths, chunksize)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def write_tables(results, directory):
+    """
+    Write the table of every successful build to <directory>/<name>.ll1.
+    Nothing is written when two grammars would get the same file, e.g.
+    a/g.txt and b/g.txt.
+    @return:
+    list of written paths
+    @raise:
+    ValueError - on clashing output names
+    """
+    outputs = collections.OrderedDict()
+    for result in results:
+        if result.table is None:
+            continue
+        name = os.path.splitext(os.path.basename(result.path))[0]
+        out = os.path.join(directory, name + SUFFIX)
+        if out in outputs:
+            raise ValueError("{0} and {1} would both be written to {2}"
+                             .format(outputs[out].path, result.path, out))
+        outputs[out] = result
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    for out, result in outputs.iteritems():
+        with open(out, "wb") as fh:
+            fh.write(result.table)
+    return list(outputs)
+
+
+def main():
+    args = p.parse_args(sys.argv[1:])
+    simplelog.sl.disable()
+    try:
+        paths = expand(args.grammars)
+    except ValueError as err:
+        p.error(str(err))
+    results = build_all(paths, args.jobs)
+    try:
+        write_tables(results, args.output)
+    except ValueError as err:
+        sys.stderr.write("{0}\n".format(err))
+        return 1
+    report = []
+    for result in results:
+        if result.error is not None:
+            report.append("{0}: {1}\n".format(result.path, result.error))
+        for conflict in result.conflicts:
+            report.append("{0}: {1}\n".format(result.path, conflict))
+    sys.stderr.write("".join(report))
+    failed = sum(1 for result in results if result.error is not None)
+    sys.stderr.write("{0} grammars, {1} failed\n".format(len(results),
+                                                           failed))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
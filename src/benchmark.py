@@ -0,0 +1,533 @@
+#!/usr/bin/env python2.7
+"""
+Scanner and parser benchmarks
+
+The stages benchmark runs every stage from scanning to the parse table
+on seeded synthetic grammars and can save its results as json, to be
+compared with the results of another commit:
+
+    python benchmark.py stages --json before.json
+    python benchmark.py stages --compare before.json
+"""
+
+
+import argparse
+import collections
+import imp
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import timeit
+
+import batch
+import cache
+import codegen
+import compiler
+import simplelog
+import table_generator
+
+
+#in the order they run, name "x-y" runs bench_x_y
+BENCHMARK_NAMES = ["scanner-linear", "trace-overhead", "ll1-parser",
+                   "incremental", "batch", "enum-lookup", "scanner-construct",
+                   "codegen", "stages"]
+
+p = argparse.ArgumentParser(description = "parser generator benchmarks",
+                            formatter_class = argparse.ArgumentDefaultsHelpFormatter)
+#the default must be a choice itself, python 2 checks it against choices
+p.add_argument('benchmarks', nargs = '*', default = "all",
+                choices = ["all"] + BENCHMARK_NAMES,
+                help = "benchmarks to run")
+p.add_argument('-r', '--repeat', type = int, default = 3,
+                help = "keep the best of this many runs")
+p.add_argument('--seed', type = int, default = 0,
+                help = "seed of the synthetic grammars")
+p.add_argument('--json', help = "save the stages results to this file")
+p.add_argument('--compare', help = "stages results of an earlier run")
+p.add_argument('--threshold', type = float, default = 1.2,
+                help = "slowdown ratio reported as a regression")
+
+STAGES = ["scan", "parse", "ll1", "first", "follow", "predict", "table"]
+
+#synthetic grammar of the base case, the other cases change one knob
+BASE_CASE = {"rules": 500, "alternatives": 3, "rhs_length": 4,
+             "epsilon": 0.1, "recursion": 0.2, "depth": 8}
+CASES = [("base", {}),
+         ("rules-5000", {"rules": 5000}),
+         ("alternatives-10", {"alternatives": 10}),
+         ("rhs-16", {"rhs_length": 16}),
+         ("epsilon-0.9", {"epsilon": 0.9}),
+         ("recursion-0.8", {"recursion": 0.8}),
+         ("depth-1", {"depth": 1}),
+         ("depth-100", {"depth": 100})]
+
+
+def best_of(repeat, func, *args):
+    """
+    Best wall time of several runs
+    """
+    best = None
+    for _ in xrange(repeat):
+        start = time.time()
+        func(*args)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def write_input(directory, name, text):
+    """
+    Write a benchmark input file and return its path
+    """
+    path = os.path.join(directory, name)
+    with open(path, "wb") as fh:
+        fh.write(text)
+    return path
+
+
+def scan(path):
+    return compiler.Scanner(path).execute()
+
+
+def scan_and_parse(path):
+    s = compiler.Scanner(path)
+    return compiler.Parser(s.iter_tokens(), None).execute()
+
+
+def chain_grammar(rules):
+    """
+    Grammar text with rules nonterminals, each deriving the next one
+    """
+    lines = ["Goal : N0 ;"]
+    for i in xrange(rules):
+        lines.append("N%d : a b c N%d\n   | d\n   ;" % (i, i + 1))
+    lines.append("N%d : epsilon ;" % rules)
+    return "\n".join(lines) + "\n"
+
+
+def synthetic_grammar(rules, alternatives = 3, rhs_length = 4, epsilon = 0.1,
+                      recursion = 0.2, depth = 8, terminals = 32, seed = 0):
+    """
+    Random bnf grammar, the same text for the same arguments
+    @param:
+    rules - nonterminals besides Goal
+    alternatives - most right hand sides per nonterminal
+    rhs_length - most symbols per right hand side
+    epsilon - chance that a nonterminal also derives epsilon
+    recursion - chance that a right hand side ends in its own nonterminal
+    depth - the nonterminals are split into this many levels, symbols
+            only refer to the next level so derivations nest this deep
+    terminals - distinct terminal names
+    seed - random seed
+    """
+    rng = random.Random(seed)
+    levels = [[] for _ in xrange(depth)]
+    for i in xrange(rules):
+        levels[i * depth // rules].append("N%d" % i)
+    lines = ["Goal : N0 ;"]
+    for level, names in enumerate(levels):
+        below = levels[level + 1] if level + 1 < depth else []
+        for name in names:
+            expansions = []
+            for _ in xrange(rng.randint(1, alternatives)):
+                symbols = []
+                for _ in xrange(rng.randint(1, rhs_length)):
+                    if below and rng.random() < 0.3:
+                        symbols.append(rng.choice(below))
+                    else:
+                        symbols.append("t%d" % rng.randrange(terminals))
+                if rng.random() < recursion:
+                    symbols.append(name)
+                expansions.append(" ".join(symbols))
+            if rng.random() < epsilon:
+                expansions.append("epsilon")
+            lines.append("%s : %s\n   ;" % (name, "\n   | ".join(expansions)))
+    return "\n".join(lines) + "\n"
+
+
+def _maxrss():
+    """
+    Peak resident memory of this process in KB
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _deep(func):
+    """
+    Run func in a thread with a large stack, the recursive Parser nests
+    a few frames per production set
+    """
+    result = []
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(1000000)
+    size = threading.stack_size(512 * 1024 * 1024)
+    try:
+        thread = threading.Thread(target = lambda: result.append(func()))
+        thread.start()
+        thread.join()
+    finally:
+        threading.stack_size(size)
+        sys.setrecursionlimit(limit)
+    return result[0] if result else None
+
+
+def run_stages(path):
+    """
+    Run every stage once on a grammar file. Meant for a fresh process.
+    Resident memory only has a running peak, so the memory of a stage is
+    how far it raised that peak and the process peak is measured after
+    the last stage.
+    @return:
+    dict with "stages", stage -> {"seconds", "added_memory_kb"}, and
+    "peak_memory_kb"
+    """
+    baseline = _maxrss()
+    stages = {}
+    def timed(stage, func, *args):
+        peak = _maxrss()
+        start = time.time()
+        result = func(*args)
+        stages[stage] = {"seconds": time.time() - start,
+                         "added_memory_kb": _maxrss() - peak}
+        return result
+    def scan():
+        s = compiler.Scanner(path)
+        return s.execute()
+    def ll1():
+        ir = collections.defaultdict(list)
+        start = None
+        sets = table_generator._production_sets(tokens[:-1], types) #no EOF
+        for production_set in sets:
+            lhs, expansions = table_generator._production_set_ir(
+                                                    production_set, types)
+            ir[lhs].extend(expansions)
+            start = start or lhs
+        return ir, start
+
+    tokens = timed("scan", scan)
+    types = compiler.shared_enums()[0]
+    timed("parse", _deep, compiler.Parser(tokens, None,
+                                          build_tree = False).execute)
+    ir, start = timed("ll1", ll1)
+    generator = table_generator.TableGenerator.from_ir(ir, start)
+    timed("first", generator.first_set)
+    timed("follow", generator.follow_set)
+    timed("predict", generator.predict_set)
+    timed("table", generator.build_table)
+    return {"stages": stages, "peak_memory_kb": _maxrss() - baseline}
+
+
+def run_case(directory, name, params, repeat):
+    """
+    Run the stages on a synthetic grammar, each repeat in a new process
+    @return:
+    dict with the grammar parameters and size, the best time and memory
+    of every stage and the lowest peak memory of a run
+    """
+    text = synthetic_grammar(**params)
+    path = write_input(directory, "stages_%s.txt" % name, text)
+    runs = []
+    for _ in xrange(repeat):
+        pool = multiprocessing.Pool(1)
+        try:
+            runs.append(pool.apply(run_stages, (path,)))
+        finally:
+            pool.close()
+            pool.join()
+    stages = {}
+    for stage in STAGES:
+        stages[stage] = dict((key, min(run["stages"][stage][key]
+                                       for run in runs))
+                             for key in ("seconds", "added_memory_kb"))
+    return {"params": params, "bytes": len(text),
+            "tokens": len(compiler.Scanner(path).execute()),
+            "stages": stages,
+            "peak_memory_kb": min(run["peak_memory_kb"] for run in runs)}
+
+
+def compare(old, new, threshold):
+    """
+    Compare stages results of two runs, the time and added memory of
+    every stage and the peak memory of every case. Differences below 5ms
+    or 1MB are noise.
+    @return:
+    tuple object (report lines, number of regressions)
+    """
+    report = []
+    regressions = 0
+    for name, case in sorted(new["cases"].iteritems()):
+        before = old["cases"].get(name)
+        if before is None or before["params"] != case["params"]:
+            report.append("%-16s not in the old results" % name)
+            continue
+        measures = []
+        for stage in STAGES:
+            for key, noise in (("seconds", 0.005), ("added_memory_kb", 1024)):
+                measures.append((stage, key, noise, before["stages"][stage],
+                                 case["stages"][stage]))
+        measures.append(("-", "peak_memory_kb", 1024, before, case))
+        for stage, key, noise, old_values, new_values in measures:
+            if key not in old_values: #not in results of older commits
+                continue
+            was = old_values[key]
+            now = new_values[key]
+            if now - was > noise and now > was * threshold:
+                regressions += 1
+                report.append("%-16s %-8s %-14s %10.4g -> %.4g" % (
+                                name, stage, key, was, now))
+    report.append("%d regressions against %s" % (regressions,
+                                                 old.get("commit")))
+    return report, regressions
+
+
+def _commit():
+    """
+    Commit of the working tree, None outside a git checkout
+    """
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"],
+            cwd = os.path.dirname(os.path.abspath(__file__)),
+            stderr = open(os.devnull, "w")).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_stages(directory, repeat, seed = 0):
+    """
+    Time and memory of every stage, scanning to parse table, and peak
+    memory on synthetic grammars of different shapes
+    @return:
+    results for --json and --compare
+    """
+    table_generator.bnf_table() #built once, before the workers fork
+    print("%-16s %-8s " % ("case", "tokens") +
+          " ".join("%-8s" % stage for stage in STAGES) + " peak MB")
+    cases = {}
+    for name, change in CASES:
+        params = dict(BASE_CASE, seed = seed, **change)
+        case = cases[name] = run_case(directory, name, params, repeat)
+        stages = case["stages"]
+        print("%-16s %-8d " % (name, case["tokens"]) +
+              " ".join("%-8.4f" % stages[stage]["seconds"]
+                       for stage in STAGES) +
+              " %.1f" % (case["peak_memory_kb"] / 1024.))
+    return {"commit": _commit(), "python": platform.python_version(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "repeat": repeat,
+            "cases": cases}
+
+
+def bench_scanner_linear(directory, repeat):
+    """
+    Scanning time per character must not grow with the symbol length.
+    Every input holds 1M characters of symbols of the given length.
+    """
+    total = 1000000
+    print("%-12s %-8s %-10s %s" % ("symbol len", "count", "seconds",
+                                   "us/char"))
+    for length in (10, 1000, 10000, 100000):
+        count = total // length
+        text = "\n".join(["a" * (length - 1) + "b"] * count) + "\n"
+        path = write_input(directory, "linear_%d.txt" % length, text)
+        elapsed = best_of(repeat, scan, path)
+        print("%-12d %-8d %-10.4f %.3f" % (length, count, elapsed,
+                                           elapsed * 1e6 / len(text)))
+
+
+def bench_trace_overhead(directory, repeat):
+    """
+    Scanning and parsing with simplelog tracing on and off.
+    The parser recurses per production, so the grammar stays small.
+    """
+    path = write_input(directory, "trace.txt", chain_grammar(150))
+    sl = simplelog.sl
+    sl.enable()
+    sl.quiet()
+    traced = best_of(repeat, scan_and_parse, path)
+    sl.disable()
+    untraced = best_of(repeat, scan_and_parse, path)
+    print("%-10s %.4f s" % ("traced", traced))
+    print("%-10s %.4f s" % ("disabled", untraced))
+
+
+def bench_ll1_parser(directory, repeat):
+    """
+    Recursive descent Parser against the table driven LL1Parser on the
+    same tokens. Only the LL1Parser gets the large grammar, the
+    recursive one runs out of stack on it.
+    """
+    table = table_generator.bnf_table()
+    print("%-8s %-10s %-10s %s" % ("rules", "tokens", "Parser", "LL1Parser"))
+    for rules in (150, 5000):
+        path = write_input(directory, "ll1_%d.txt" % rules,
+                           chain_grammar(rules))
+        s = compiler.Scanner(path)
+        tokens = s.execute()
+        terminals = table_generator.bnf_terminals(s.TOKENS)
+        recursive = "-"
+        if rules <= 150:
+            recursive = "%.4f" % best_of(repeat, lambda:
+                compiler.Parser(tokens, s.bnf_file).execute())
+        driven = best_of(repeat, lambda:
+            compiler.LL1Parser(table, tokens, terminals).execute())
+        print("%-8d %-10d %-10s %.4f" % (rules, len(tokens), recursive,
+                                         driven))
+
+
+def bench_incremental(directory, repeat):
+    """
+    regenerate after editing one production of a large grammar against
+    a cold run, both without the recursive parser
+    """
+    print("%-8s %-10s %s" % ("rules", "cold", "edit"))
+    for rules in (1000, 5000):
+        path = write_input(directory, "incremental_%d.txt" % rules,
+                           chain_grammar(rules))
+        table_cache = cache.TableCache(os.path.join(directory, "cache"))
+        with open(path) as fh:
+            text = fh.read()
+        #swap two terminals in the middle rule and back, the symbols stay
+        #the same so no full rebuild is needed
+        middle = "N%d : " % (rules // 2)
+        edits = [text.replace(middle + "a b", middle + "b a"), text]
+        def cold():
+            table_cache.clear()
+            table_generator.regenerate(path, table_cache)
+        def edit():
+            for edited in edits:
+                write_input(directory, os.path.basename(path), edited)
+                table_generator.regenerate(path, table_cache)
+        cold_time = best_of(repeat, cold)
+        edit_time = best_of(repeat, edit) / len(edits)
+        print("%-8d %-10.4f %.4f" % (rules, cold_time, edit_time))
+
+
+def bench_batch(directory, repeat):
+    """
+    Batch build of many grammars with a growing number of workers,
+    speedup should stay close to the worker count up to the cpu count
+    """
+    paths = [write_input(directory, "batch_%d.txt" % i, chain_grammar(300))
+             for i in xrange(64)]
+    batch.prepare()
+    print("%-8s %-10s %s" % ("jobs", "seconds", "speedup"))
+    serial = None
+    jobs = 1
+    while jobs <= multiprocessing.cpu_count():
+        elapsed = best_of(repeat, batch.build_all, paths, jobs)
+        serial = serial or elapsed
+        print("%-8d %-10.4f %.2f" % (jobs, elapsed, serial / elapsed))
+        jobs *= 2
+
+
+def bench_enum_lookup(directory, repeat):
+    """
+    The parser's per token check, word.type == self.TOKENS.X, against
+    a comparison with a local constant, and reverse lookups
+    """
+    setup = ("import compiler, utils\n"
+             "tokens = utils.Enum('SEMICOLON', 'DERIVES', 'ALSODERIVES',"
+             " 'EPSILON', 'SYMBOL', 'EOF')\n"
+             "SYMBOL = tokens.SYMBOL\n"
+             "word = compiler.Token('foo', tokens.SYMBOL, 1, 0)\n")
+    number = 1000000
+    print("%-34s %s" % ("statement", "ns/op"))
+    for statement in ("word.type == tokens.SYMBOL",
+                      "word.type == SYMBOL",
+                      "tokens.get_key_for_value(4)"):
+        elapsed = min(timeit.repeat(statement, setup, repeat = repeat,
+                                    number = number))
+        print("%-34s %.1f" % (statement, elapsed / number * 1e9))
+
+
+def bench_scanner_construct(directory, repeat):
+    """
+    Cost of a Scanner for a tiny grammar, enums and tables are shared so
+    this is mostly reading the file
+    """
+    path = write_input(directory, "snippet.txt", "Goal : a ;\n")
+    number = 2000
+    elapsed = best_of(repeat, lambda: [compiler.Scanner(path)
+                                       for _ in xrange(number)])
+    print("%.1f us per Scanner" % (elapsed / number * 1e6))
+
+
+def bench_codegen(directory, repeat):
+    """
+    Scanning and parsing with the generated standalone bnf parser against
+    Scanner + Parser and Scanner + LL1Parser, from the text to the result.
+    The recursive Parser only gets the small grammar.
+    """
+    module = imp.load_source("bnf_generated",
+        write_input(directory, "bnf_generated.py", codegen.generate(
+                                            table_generator.BNF_GRAMMAR)))
+    table = table_generator.bnf_table()
+    print("%-8s %-10s %-10s %s" % ("rules", "Parser", "LL1Parser",
+                                   "generated"))
+    for rules in (150, 5000):
+        path = write_input(directory, "codegen_%d.txt" % rules,
+                           chain_grammar(rules))
+        with open(path, "rb") as fh:
+            text = fh.read()
+        def ll1():
+            s = compiler.Scanner(path)
+            terminals = table_generator.bnf_terminals(s.TOKENS)
+            compiler.LL1Parser(table, s.iter_tokens(), terminals).execute()
+        recursive = "-"
+        if rules <= 150:
+            recursive = "%.4f" % best_of(repeat, lambda:
+                compiler.Parser(compiler.Scanner(path).iter_tokens(), None,
+                                build_tree = False).execute())
+        print("%-8d %-10s %-10.4f %.4f" % (rules, recursive,
+                best_of(repeat, ll1), best_of(repeat, module.parse, text)))
+
+
+BENCHMARKS = [(name, globals()["bench_" + name.replace("-", "_")])
+              for name in BENCHMARK_NAMES]
+
+
+def main():
+    args = p.parse_args(sys.argv[1:])
+    selected = args.benchmarks
+    if "all" in selected: #the default is the string "all"
+        selected = BENCHMARK_NAMES
+    simplelog.sl.disable()
+    directory = tempfile.mkdtemp()
+    results = None
+    try:
+        for name, bench in BENCHMARKS:
+            if name not in selected:
+                continue
+            print("== " + name)
+            if bench is bench_stages:
+                results = bench(directory, args.repeat, args.seed)
+            else:
+                bench(directory, args.repeat)
+    finally:
+        shutil.rmtree(directory)
+    if results is None:
+        return 0
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(results, fh, indent = 1, sort_keys = True,
+                      separators = (",", ": "))
+    if args.compare:
+        with open(args.compare) as fh:
+            report, regressions = compare(json.load(fh), results,
+                                          args.threshold)
+        print("\n".join(report))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
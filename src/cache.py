@@ -0,0 +1,218 @@
+"""
+On disk cache for generated tables.
+
+Entries are pickled files, or plain bytes with get_raw and put_raw,
+named after a hash of their input and the generator version. Writes go
+to a temporary file that is renamed into place, so readers in other
+processes see either nothing or a complete entry. Reading an entry bumps
+its modification time, and once the directory grows past its size limit
+the least recently used entries are removed under an exclusive lock.
+The directory is scanned for its size once, later writes only add to
+that estimate until it goes over the limit, and eviction leaves room
+for more writes before the next scan.
+
+Unpickling runs code, so the cache directory is only used when it
+belongs to the current user and nobody else can write to it. The
+default directory is per user and created with mode 0700.
+"""
+
+import cPickle as pickle
+import errno
+import fcntl
+import hashlib
+import os
+import stat
+import tempfile
+
+__all__ = ["TableCache", "DEFAULT_DIR", "VERSION"]
+
+VERSION = "1" #bump when anything that ends up in the cache changes
+_XDG_CACHE_HOME = os.environ.get("XDG_CACHE_HOME", "")
+if not os.path.isabs(_XDG_CACHE_HOME): #relative paths are invalid
+    _XDG_CACHE_HOME = os.path.join(os.path.expanduser("~"), ".cache")
+DEFAULT_DIR = os.environ.get("PARSER_GENERATOR_CACHE") or \
+                os.path.join(_XDG_CACHE_HOME, "parser_generator")
+SUFFIX = ".cache"
+LOW_WATER = 0.75 #eviction leaves this fraction of max_size for new entries
+
+
+class TableCache(object):
+    """
+    Size bounded, least recently used cache directory.
+
+    @param:
+    path - cache directory, created with mode 0700 on first write. A
+           directory owned by another user or writable by group or others
+           is never read or written.
+    max_size - bytes kept before old entries are evicted
+    """
+    def __init__(self, path = DEFAULT_DIR, max_size = 256 * 1024 * 1024):
+        self.path = path
+        self.max_size = max_size
+        self._size = None #estimated bytes of the entries, None until scanned
+
+    @staticmethod
+    def key(*parts):
+        """
+        Cache key for the given input strings and the generator version
+        """
+        digest = hashlib.sha1(VERSION)
+        for part in parts:
+            digest.update("\0")
+            digest.update(part)
+        return digest.hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.path, key + SUFFIX)
+
+    def _private(self, create = False):
+        """
+        True if the cache directory belongs to the current user and only
+        they can write to it
+        @param:
+        create - make a missing directory first
+        """
+        if create:
+            try:
+                os.makedirs(self.path, 0o700)
+            except OSError as err:
+                if err.errno != errno.EEXIST:
+                    return False
+        try:
+            info = os.stat(self.path)
+        except OSError:
+            return False
+        return (stat.S_ISDIR(info.st_mode) and info.st_uid == os.getuid()
+                and not info.st_mode & (stat.S_IWGRP | stat.S_IWOTH))
+
+    def get_raw(self, key):
+        """
+        @return:
+        the bytes of an entry, None on a miss
+        """
+        if not self._private():
+            return None
+        path = self._file(key)
+        try:
+            with open(path, "rb") as fh:
+                data = fh.read()
+        except (IOError, OSError):
+            return None
+        try:
+            os.utime(path, None) #mark as recently used
+        except OSError:
+            pass
+        return data
+
+    def get(self, key):
+        """
+        @return:
+        the cached value, None on a miss or an unreadable entry
+        """
+        data = self.get_raw(key)
+        if data is None:
+            return None
+        try:
+            return pickle.loads(data)
+        except (EOFError, ValueError, TypeError, AttributeError,
+                ImportError, IndexError, KeyError, pickle.UnpicklingError):
+            return None
+
+    def put_raw(self, key, data):
+        """
+        Store bytes, caching is best effort and never raises for io
+        """
+        if not self._private(create = True):
+            return False
+        tmp = None
+        try:
+            fd, tmp = tempfile.mkstemp(dir = self.path, suffix = ".tmp")
+            with os.fdopen(fd, "wb") as fh:
+                fh.write(data)
+            os.rename(tmp, self._file(key))
+        except (IOError, OSError):
+            if tmp is not None and os.path.exists(tmp):
+                os.remove(tmp)
+            return False
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self._entries())
+        else:
+            self._size += len(data) #replaced entries are counted twice
+        if self._size > self.max_size:
+            self.evict()
+        return True
+
+    def put(self, key, value):
+        """
+        Store a value, caching is best effort and never raises for io
+        """
+        try:
+            data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError):
+            return False
+        return self.put_raw(key, data)
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache fits in
+        LOW_WATER of max_size. Skipped while another process is evicting.
+        put_raw calls it once its size estimate is over max_size.
+        """
+        if not self._private():
+            return
+        try:
+            lock = open(os.path.join(self.path, ".lock"), "a")
+        except IOError:
+            return
+        try:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                return
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, name in entries:
+                if total <= self.max_size * LOW_WATER:
+                    break
+                try:
+                    os.remove(os.path.join(self.path, name))
+                except OSError:
+                    pass
+                total -= size
+            self._size = total
+        finally:
+            lock.close() #releases the lock
+
+    def _entries(self):
+        """
+        @return:
+        list of (modification time, size, file name) of every entry
+        """
+        entries = []
+        try:
+            names = os.listdir(self.path)
+        except OSError:
+            return entries
+        for name in names:
+            if not name.endswith(SUFFIX):
+                continue
+            try:
+                info = os.stat(os.path.join(self.path, name))
+            except OSError:
+                continue #removed by someone else
+            entries.append((info.st_mtime, info.st_size, name))
+        return entries
+
+    def clear(self):
+        """
+        Remove every entry
+        """
+        if not self._private():
+            return
+        for name in os.listdir(self.path):
+            if name.endswith(SUFFIX):
+                try:
+                    os.remove(os.path.join(self.path, name))
+                except OSError:
+                    pass
+        self._size = 0
@@ -0,0 +1,246 @@
+#!/usr/bin/env python2.7
+"""
+Generate a standalone python scanner and parser for a grammar.
+
+The generated module imports only the standard library. Its scanner has
+the dfa of the token spec inlined as one dict per state from character
+to next state, so no classifier lookup or ord() is needed per
+character, and its parser is the table driven LL(1) loop of
+compiler.LL1Parser with the table inlined as a tuple.
+"""
+
+
+import argparse
+import sys
+
+import automata
+import compiler
+import simplelog
+import table_generator
+
+
+p = argparse.ArgumentParser(description = "generate a standalone parser module",
+                            formatter_class = argparse.ArgumentDefaultsHelpFormatter)
+p.add_argument('grammar', nargs = '?', default = table_generator.BNF_GRAMMAR,
+                help = "bnf grammar, the default generates a bnf parser")
+p.add_argument('-o', '--output', default = "-",
+                help = "file for the module, - writes stdout")
+
+
+#everything after the tables, the same for every grammar
+RUNTIME = r'''
+Token = collections.namedtuple("Token", ["value", "type", "lino", "offset"])
+
+
+class ParseError(Exception):
+    """
+    Raised for input the grammar does not derive
+    """
+    pass
+
+
+def tokens(text):
+    """
+    Tokenize text, longest match wins and ties go to the earlier token
+    @return:
+    list of Token, ending with the EOF token
+    """
+    delta = DELTA
+    accept = ACCEPT
+    types = TYPES
+    out = []
+    append = out.append
+    length = len(text)
+    lino = 1
+    pos = 0
+    while pos < length:
+        char = text[pos]
+        if char == " " or char == "\t":
+            pos += 1
+            continue
+        if char == "\n":
+            lino += 1
+            pos += 1
+            continue
+        token = -1
+        end = cursor = pos
+        row = delta[0]
+        while cursor < length:
+            state = row.get(text[cursor])
+            if state is None:
+                break
+            cursor += 1
+            if accept[state] >= 0:
+                token = accept[state]
+                end = cursor
+            row = delta[state]
+        if token < 0:
+            raise ParseError("line {0}: invalid character {1!r}".format(
+                                lino, char))
+        append(Token(text[pos:end], types[token], lino, pos))
+        pos = end
+    append(Token("", EOF, lino, pos))
+    return out
+
+
+def _fail(expected, word):
+    if expected is None:
+        what = "a terminal of the grammar"
+    elif expected >= 0:
+        what = TERMINALS[expected]
+    else:
+        what = NONTERMINALS[-expected - 1]
+    raise ParseError("line {0}: expected {1}, got {2!r}".format(
+                        word.lino, what, word.value))
+
+
+def parse(text):
+    """
+    Parse text
+    @return:
+    list of production numbers of the leftmost derivation, see
+    PRODUCTIONS
+    """
+    table = TABLE
+    width = WIDTH
+    pushes = PUSHES
+    type_column = TYPE_COLUMN
+    value_column = VALUE_COLUMN
+    derivation = []
+    append = derivation.append
+    stack = [-1] #start symbol, nonterminal codes are -(index + 1)
+
+    words = iter(tokens(text))
+    word = next(words)
+    column = type_column.get(word.type)
+    if column is None:
+        column = value_column.get(word.value)
+        if column is None:
+            _fail(None, word)
+    while stack:
+        top = stack.pop()
+        if top >= 0:
+            if top != column:
+                _fail(top, word)
+            word = next(words)
+            column = type_column.get(word.type)
+            if column is None:
+                column = value_column.get(word.value)
+                if column is None:
+                    _fail(None, word)
+        else:
+            number = table[(-top - 1) * width + column]
+            if number < 0:
+                _fail(top, word)
+            append(number)
+            stack.extend(pushes[number])
+    if column != 0:
+        _fail(0, word)
+    return derivation
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "rb") as fh:
+            source = fh.read()
+    else:
+        source = sys.stdin.read()
+    try:
+        derivation = parse(source)
+    except ParseError as err:
+        sys.stderr.write("{0}\n".format(err))
+        sys.exit(1)
+    sys.stdout.write("".join(PRODUCTIONS[n] + "\n" for n in derivation))
+'''
+
+
+def _deltas(tables):
+    """
+    Per state dicts from character to next state, dead transitions left
+    out
+    """
+    classifier, transition, _, _, num_classes = tables
+    deltas = []
+    for state in xrange(len(transition) // num_classes):
+        row = transition[state * num_classes:(state + 1) * num_classes]
+        deltas.append(dict((chr(code), row[classifier[code]])
+                           for code in xrange(256)
+                           if row[classifier[code]] != automata.ERROR))
+    return deltas
+
+
+def generate_source(table, spec, terminals, eof, grammar = "a grammar"):
+    """
+    Source of a standalone parser module
+    @param:
+    table - table_generator.ParseTable
+    spec - scanner token spec, list of (token type, regex)
+    terminals - dict of token type -> terminal name, tokens of other
+                types are matched by their value
+    eof - token type of the end of input
+    grammar - name of the grammar for the module docstring
+    @return:
+    string
+    """
+    tables = automata.compile_spec(spec)
+    type_column = {eof: table.EOF_COLUMN}
+    for token_type, name in terminals.iteritems():
+        if name in table.column:
+            type_column[token_type] = table.column[name]
+    out = ['#!/usr/bin/env python2.7\n'
+           '"""\n'
+           'LL(1) parser for {0}, generated by codegen.py.\n'
+           'Do not edit, regenerate it from the grammar instead.\n'
+           '"""\n\n'
+           'import collections\n'
+           'import sys\n\n'.format(grammar)]
+    def define(name, value):
+        out.append("{0} = {1!r}\n".format(name, value))
+    define("DELTA", tuple(_deltas(tables)))
+    define("ACCEPT", tuple(tables.accept))
+    define("TYPES", tables.tokens)
+    define("EOF", eof)
+    define("NONTERMINALS", tuple(table.nonterminals))
+    define("TERMINALS", tuple(["EOF"] + [str(t) for t in table.terminals]))
+    define("PRODUCTIONS", tuple(table.format_production(n)
+                                for n in xrange(len(table.productions))))
+    define("WIDTH", table.width)
+    define("TABLE", tuple(table.table))
+    define("PUSHES", tuple(tuple(reversed(rhs))
+                           for _, rhs in table.productions))
+    define("TYPE_COLUMN", type_column)
+    define("VALUE_COLUMN", table.column)
+    out.append(RUNTIME)
+    return "".join(out)
+
+
+def generate(grammar, text = None):
+    """
+    Standalone parser source for a bnf grammar. The generated scanner is
+    the bnf scanner, terminals named like its token types (SYMBOL,
+    SEMICOLON, ...) match by type and all others by value.
+    @param:
+    text - grammar text, see table_generator.build
+    @return:
+    string
+    """
+    generator = table_generator.build(grammar, text)
+    scanner = compiler.Scanner("<string>", text = "")
+    return generate_source(generator.TABLE, scanner.SPEC,
+                           table_generator.bnf_terminals(scanner.TOKENS),
+                           scanner.TOKENS.EOF, grammar)
+
+
+def main():
+    args = p.parse_args(sys.argv[1:])
+    simplelog.sl.disable()
+    source = generate(args.grammar)
+    if args.output == "-":
+        sys.stdout.write(source)
+    else:
+        with open(args.output, "wb") as fh:
+            fh.write(source)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,50 @@
+import array
+import automata
 import collections
-import re
+import mmap
+import os
 import simplelog
+import stats
 
 from utils import *
-from pylibs.data_structures import graph, tree
+
+tree = None #pylibs.data_structures.tree, imported with the first tree node
+
+CHUNK_SIZE = 1 << 16 #bytes read at a time when streaming
+
+Token = collections.namedtuple("Token", ["value", "type", "lino", "offset"])
+"""
+Scanner output.
+value - lexeme text
+type - token type, one of CompilerBase.TOKENS
+lino - line number
+offset - position of the lexeme in the input file
+"""
+
+_ENUMS = {} #verbose flag -> enums, see shared_enums
+
+
+def shared_enums(verbose = False):
+    """
+    Token, parser state and symbol type enums. They are built once per
+    verbose flag and frozen, every compiler object shares them.
+    @return:
+    tuple object (TOKENS, states, types)
+    """
+    enums = _ENUMS.get(verbose)
+    if enums is None:
+        #TODO: make eof something that can't appear in the grammar 
+        enums = _ENUMS[verbose] = (
+            Enum("SEMICOLON", "DERIVES", "ALSODERIVES",
+                 "EPSILON", "SYMBOL", "EOF",
+                 verbose = verbose).freeze(),
+            Enum("GRAMMAR", "PRODUCTIONLIST", "PRODUCTIONSET",
+                 "RIGHTHANDSIDE", "SYMBOLLIST", "SYMBOLLIST_P",
+                 "PRODUCTIONSET_P", "PRODUCTIONLIST_P", start = 6,
+                 verbose = verbose).freeze(),
+            Enum("NT", "T", "UNKNOWN", verbose = verbose).freeze())
+    return enums
+
 
 class CompilerBase(object):
     """
@@ -16,40 +57,54 @@ class CompilerBase(object):
         debug - if true, print verbose output in Enum data types,
                 looks for a global DEBUG variable. 
         """
-        self.DFA = []
-        self.DFA_TABLE = [] #tuple object (token type, token dfa) 
+        self.SPEC = [] #tuple object (token type, token regex)
+        self.DFA = [] #tuple object (token type, token dfa)
+        self.DFA_TABLE = None #merged scanner tables, see automata.merge
         self.debug = False
         if globals().has_key("DEBUG"):
             self.debug = globals()["DEBUG"]
-        #TODO: make eof something that can't appear in the grammar 
-        self.TOKENS = Enum("SEMICOLON", "DERIVES", "ALSODERIVES",
-                            "EPSILON", "SYMBOL", "EOF",
-                            verbose = self.debug)
-        self._state = Enum("GRAMMAR", "PRODUCTIONLIST", "PRODUCTIONSET",
-                            "RIGHTHANDSIDE", "SYMBOLLIST", "SYMBOLLIST_P",
-                            "PRODUCTIONSET_P", "PRODUCTIONLIST_P", start = 6, 
-                            verbose = self.debug)
+        self.TOKENS, self._state = shared_enums(self.debug)[:2]
 
 class Scanner(CompilerBase):
     """
     Scanner for BNF grammar
     """
     @simplelog.dump_func(func_name_only = True)
-    def __init__(self, filename):
+    def __init__(self, filename, stream = False, use_mmap = False,
+                    text = None):
         """
         Scanner that takes a Back Naur Form (BNF) input
         file and tokenizes it 
         @param:
         filename - input file with bnf text
-        """
+        stream - if true, don't load the file up front, iter_tokens
+                 reads it in chunks instead
+        use_mmap - if true, map the file instead of reading it, the input
+                   is paged in by the os and shared with other processes.
+                   Can't be combined with stream.
+        text - bnf text that is already in memory, e.g. read from stdin,
+               filename then only names the input
+        """
+        if stream and use_mmap:
+            raise ValueError("stream and use_mmap are exclusive")
         super(Scanner, self).__init__()
         self.output = []
+        self.filename = filename
+        self.stream = stream
+        self.use_mmap = use_mmap
         self.bnf_file = None
         self.cursor = 0
+        self.offset = 0 #file position of bnf_file[0]
         self.file_length = 0
+        self.SPEC = self._token_spec()
 
         #initialization
-        self._get_input(filename)
+        if text is not None:
+            self.stream = False
+            self.bnf_file = text
+            self.file_length = len(text)
+        elif not stream:
+            self._get_input(filename)
         self.initialize()
     
     def initialize(self):
@@ -61,106 +116,73 @@ class Scanner(CompilerBase):
     @simplelog.dump_func(func_name_only = True)
     def _initialize_dfa(self, *args, **kwargs):
         """
-        Generate the dfa tables for all given dfa transitions
-        """
-        self.DFA_TABLE = []
-
-        SEMICOLON_DFA = graph.Graph()
-        SEMICOLON_DFA.add_node(0, "NT")
-        SEMICOLON_DFA.add_node(1, "T")
-        SEMICOLON_DFA.add_edge(0, 1, ";")
-
-        DERIVES_DFA = graph.Graph()
-        DERIVES_DFA.add_node(0, "NT")
-        DERIVES_DFA.add_node(1, "T")
-        DERIVES_DFA.add_edge(0, 1, ":")
-
-        ALSODERIVES_DFA = graph.Graph()
-        ALSODERIVES_DFA.add_node(0, "NT")
-        ALSODERIVES_DFA.add_node(1, "T")
-        ALSODERIVES_DFA.add_edge(0, 1, "|")
-
-        EPSILON_DFA = graph.Graph()
-        EPSILON_DFA.add_node(0, "NT") 
-        EPSILON_DFA.add_node(1, "NT") #E
-        EPSILON_DFA.add_node(2, "NT") #P
-        EPSILON_DFA.add_node(3, "NT") #S
-        EPSILON_DFA.add_node(4, "NT") #I
-        EPSILON_DFA.add_node(5, "NT") #L
-        EPSILON_DFA.add_node(6, "NT") #O
-        EPSILON_DFA.add_node(7, "T") #N
-
-        EPSILON_DFA.add_node(8, "NT")
-        EPSILON_DFA.add_node(9, "NT")
-        EPSILON_DFA.add_node(10, "NT")
-        EPSILON_DFA.add_node(11, "NT")
-        EPSILON_DFA.add_node(12, "NT")
-        EPSILON_DFA.add_node(13, "NT")
-        EPSILON_DFA.add_node(14, "T")
-
-        EPSILON_DFA.add_edge(0, 1, "E")
-        EPSILON_DFA.add_edge(1, 2, "P")
-        EPSILON_DFA.add_edge(2, 3, "S")
-        EPSILON_DFA.add_edge(3, 4, "I")
-        EPSILON_DFA.add_edge(4, 5, "L")
-        EPSILON_DFA.add_edge(5, 6, "O")
-        EPSILON_DFA.add_edge(6, 7, "N")
-
-        EPSILON_DFA.add_edge(0, 8, "e")
-        EPSILON_DFA.add_edge(8, 9, "p")
-        EPSILON_DFA.add_edge(9, 10, "s")
-        EPSILON_DFA.add_edge(10, 11, "i")
-        EPSILON_DFA.add_edge(11, 12, "l")
-        EPSILON_DFA.add_edge(12, 13, "o")
-        EPSILON_DFA.add_edge(13, 14, "n")
-
-        EPSILON_DFA.add_edge(1, 9, "p") #Episilon
-
-        lower_case_letters = "".join(map(chr, xrange(97, 123)))
-        upper_case_letters = "".join(map(chr, xrange(65, 91)))
-        numbers = "".join(map(chr, xrange(48, 58)))
-        alpha_numeric = lower_case_letters + upper_case_letters + numbers
-        SYMBOL_DFA = graph.Graph()
-        SYMBOL_DFA.add_node(0, "NT")
-        SYMBOL_DFA.add_node(1, "T")
-        SYMBOL_DFA.add_edge(0, 1, alpha_numeric)
-        SYMBOL_DFA.add_edge(1, 1, alpha_numeric)
-        
-        #Order matters when adding the DFA 
-        self.DFA.append((self.TOKENS.SEMICOLON, SEMICOLON_DFA))
-        self.DFA.append((self.TOKENS.DERIVES, DERIVES_DFA))
-        self.DFA.append((self.TOKENS.ALSODERIVES, ALSODERIVES_DFA))
-        self.DFA.append((self.TOKENS.EPSILON, EPSILON_DFA))
-        self.DFA.append((self.TOKENS.SYMBOL, SYMBOL_DFA))
-        
-        #Generate tables for everyone
-        for name, dfa in self.DFA:
-            self.DFA_TABLE.append(self._gen_tables(name, dfa))
-
+        Generate the dfa tables for all token definitions in self.SPEC
+        followed by the graph dfas in self.DFA
+        """
+        self.DFA_TABLE = automata.compile_spec(self.SPEC, self.DFA)
         return self.DFA_TABLE
 
-    def _gen_tables(self, name, dfa):
+    def _token_spec(self):
         """
-        Generate the dfa tables with given list of DFA's
-        @param:
-        dfa - the minimized determistic finite automate
+        Regular expressions for the bnf tokens.
+        Order matters, earlier tokens win ties on the same lexeme.
         @return:
-        tuple consisting of classifier table, transition table, token table
-        and set of legal states
+        list of (token type, regex)
         """
-        r = bfs(dfa, startnode = 0)
-        for key in r[2]:
-            r[2][key] = name
-        return r
+        return [(self.TOKENS.SEMICOLON, ";"),
+                (self.TOKENS.DERIVES, ":"),
+                (self.TOKENS.ALSODERIVES, r"\|"),
+                (self.TOKENS.EPSILON, "EPSILON|[Ee]psilon"),
+                (self.TOKENS.SYMBOL, "[a-zA-Z0-9]+")]
 
-    
     def _get_input(self, filename):
         """
         Read in the input and get file length
         """
+        self.close()
         with open(filename, "rb") as fh:
-            self.bnf_file = fh.read()
+            if self.use_mmap and os.fstat(fh.fileno()).st_size > 0:
+                #a mapping supports the indexing and slicing the scanner needs
+                self.bnf_file = mmap.mmap(fh.fileno(), 0,
+                                          access = mmap.ACCESS_READ)
+            else:
+                self.bnf_file = fh.read()
         self.file_length = len(self.bnf_file)
+        self.cursor = 0
+        self.offset = 0
+
+    def close(self):
+        """
+        Release the memory mapping of the input, if any
+        """
+        if isinstance(self.bnf_file, mmap.mmap):
+            self.bnf_file.close()
+            self.bnf_file = None
+            self.file_length = 0
+
+    def _read_chunks(self, chunk_size):
+        """
+        Refill the input buffer from the file, keeping everything from
+        the cursor on so that lexemes can straddle chunk boundaries.
+        A chunk is at least as large as the kept text, so rescanning a
+        long partial lexeme stays linear.
+        @return:
+        generator, yields True once the whole file is buffered
+        """
+        with open(self.filename, "rb") as fh:
+            self.bnf_file = ""
+            self.cursor = 0
+            self.offset = 0
+            while True:
+                kept = self.bnf_file[self.cursor:]
+                self.offset += self.cursor
+                chunk = fh.read(max(chunk_size, len(kept)))
+                self.bnf_file = kept + chunk
+                self.file_length = len(self.bnf_file)
+                self.cursor = 0
+                yield not chunk
+                if not chunk:
+                    return
 
     def next_char(self):
         """
@@ -188,110 +210,196 @@ class Scanner(CompilerBase):
     @simplelog.dump_func()
     def next_word(self):
         """
-        Get the enxt word of the input
-        @param:
-        context - the dfa object, the 
+        Get the next word of the input. Runs the merged dfa once and
+        returns the longest match, ties go to the earliest token dfa.
         @return
-        tuple object (value, state) 
-        """
-        _STATE = Enum("ERROR", "BAD", start = -2)
-        cursor_pos = self.cursor
-        
-        #Try every regex to try to get a valid word
-        for table_classifier, table_transition, table_token_type, state_legal in \
-                self.DFA_TABLE:
-            
-            state = 0 #start state
-            lexeme = ""
-            stack = collections.deque()
-            stack.appendleft(_STATE.BAD)
-
-            while (state != _STATE.ERROR) and (self.cursor < self.file_length):
-                char_curr = self.next_char()
-                lexeme += char_curr
-                if state in state_legal:
-                    stack.clear()
-                stack.appendleft(state)
-                try:
-                    cat = table_classifier[char_curr] #look up category
-                    state = table_transition[cat][state] #look up if we reached a valid state
-                except KeyError:
-                    state = _STATE.ERROR
-            
-            while ((state not in state_legal) and (state != _STATE.BAD)):
-                #roll backed all the way, this isn't the right word
-                state = stack.popleft()
-                lexeme = lexeme[:-1]
-                self.rollback()
-                if (lexeme == ""):
-                    break
-            if state in state_legal:
-                #if state is not here, we got an invalid entry 
-                try:
-                    return (lexeme, table_token_type[state])
-                except KeyError:
-                    self.cursor = cursor_pos #reset the cursor 
+        tuple object (value, state)
+        """
+        start = self.cursor
+        end, token, _ = self._longest_match(start)
+        if token == automata.ERROR:
+            return (False, False)
+        self.cursor = end
+        return (self.bnf_file[start:end], self.DFA_TABLE.tokens[token])
+
+    def _longest_match(self, start):
+        """
+        Run the dfa from start.
+        Only the end of the last accepted prefix is remembered, on failure
+        the cursor jumps back to it and the lexeme is sliced out once.
+        @return:
+        end - end of the longest accepted lexeme
+        token - index into the token list, automata.ERROR if nothing matched
+        stop - position where the dfa stopped, the buffer length if it ran
+               out of input
+        """
+        classifier, transition, accept, tokens, num_classes = self.DFA_TABLE
+        bnf_file = self.bnf_file
+        file_length = self.file_length
+        cursor = start
+
+        state = 0 #start state
+        token = automata.ERROR
+        end = start
+        while cursor < file_length:
+            state = transition[state * num_classes +
+                               classifier[ord(bnf_file[cursor])]]
+            if state == automata.ERROR:
+                break
+            cursor += 1
+            if accept[state] != automata.ERROR:
+                token = accept[state]
+                end = cursor
+        return end, token, cursor
+
+    def iter_tokens(self, chunk_size = CHUNK_SIZE, lino = 1):
+        """
+        Lazily tokenize the input from the cursor. Streaming scanners read
+        the file in chunks of chunk_size bytes, otherwise the loaded input
+        is used.
+        @param:
+        lino - line number at the cursor
+        @return:
+        generator of Token, ending with the EOF token
+        """
+        collector = stats.current()
+        tokens = self._tokens(chunk_size, lino, collector)
+        if collector is None:
+            return tokens
+        #time spent producing tokens is the scan stage, also when the
+        #parser pulls them
+        return collector.timed_iter("scan", tokens)
+
+    def _tokens(self, chunk_size, lino, collector):
+        """
+        Generator behind iter_tokens
+        @param:
+        collector - stats.Stats for the scanner counters, or None
+        """
+        if self.stream:
+            buffers = self._read_chunks(chunk_size)
+        else:
+            buffers = iter([True])
+        tokens = self.DFA_TABLE.tokens
+        count = steps = rollbacks = 0
+        for final in buffers:
+            while (self.cursor < self.file_length):
+                char = self.bnf_file[self.cursor]
+                #strip white space from input
+                if (char == " ") or (char == "\t"):
+                    self.cursor += 1
                     continue
-                #TODO: too much roll back error?
-        return (False, False)
-    
+                elif (char == "\n"):
+                    lino += 1
+                    self.cursor += 1
+                    continue
+                start = self.cursor
+                end, token, stop = self._longest_match(start)
+                if (stop == self.file_length) and not final:
+                    break #the lexeme may continue in the next chunk
+                if token == automata.ERROR:
+                    raise ParseError("line {0}: invalid character {1!r}"
+                                     .format(lino, self.bnf_file[start]))
+                if collector is not None:
+                    count += 1
+                    steps += stop - start
+                    rollbacks += stop - end
+                self.cursor = end
+                yield Token(self.bnf_file[start:end], tokens[token], lino,
+                            self.offset + start)
+        if collector is not None:
+            collector.count("tokens", count)
+            collector.count("dfa_steps", steps)
+            collector.count("rollbacks", rollbacks)
+        yield Token("", self.TOKENS.EOF, lino, self.offset + self.cursor)
+
+    def scan_range(self, start, end, lino = 1):
+        """
+        Tokenize only input[start:end], used to rescan an edited region.
+        Both ends must lie on token boundaries.
+        @param:
+        lino - line number at start
+        @return:
+        list of Token, without EOF
+        """
+        file_length = self.file_length
+        self.cursor = start
+        self.file_length = end
+        try:
+            return list(self.iter_tokens(lino = lino))[:-1]
+        finally:
+            self.file_length = file_length
+
     @simplelog.dump_func()
     def execute(self):
         """
         Run scanner and words into tokens
         """
-        lino = 1 
-        while (self.cursor < self.file_length):
-            char = self._next_char()
-            #strip white space from input
-            if (char == " "):
-                self.next_char()
-            elif (char == "\n"):
-                lino += 1
-                self.next_char()
-            elif (char == "\t"):
-                self.next_char()
-            else:
-                word, token_type = self.next_word()
-                if word is False:
-                    #TODO: make a better exception 
-                    word = self.bnf_file[self.cursor:self.bnf_file.find(" ")]
-                    print (word + " is invalid")
-                    print ("cursor position: " + str(self.cursor))
-                    print ("lino: " + str(lino))
-                    raise Exception("Got an invalid character")
-                self.output.append({"value":word, "type":token_type, "lino": lino})
-        self.output.append({"value":"", "type":self.TOKENS.EOF, "lino": lino})
+        self.output.extend(self.iter_tokens())
         return self.output
 
 class Parser(CompilerBase):
     """
     Parser for bnf grammar. Uses a recursive descent parser
     """
-    def __init__(self, input_scan, input_raw):
+    def __init__(self, input_scan, input_raw, build_tree = True):
         """
         Parser for bnf langauge
         Build a parse tree for language
         @parser:
-        input_scan - tokenized output of scanner
+        input_scan - tokenized output of scanner, any iterable of tokens
+                     such as Scanner.iter_tokens()
         input_raw - input text of bnf file 
+        build_tree - if false, no parse tree is built and execute returns
+                     the productions in IR instead
         """
         super(Parser, self).__init__()
         self.input_raw = input_raw
         self.input_scan = input_scan 
+        self._tokens = iter(input_scan)
         self.index = 0
         self.word = "" 
+        self.build_tree = build_tree
 
-        self._type = Enum("NT", "T", "UNKNOWN", verbose = self.debug)
+        #productions, collected while parsing
+        self.IR = collections.defaultdict(list) #lhs -> [rhs tuple]
+        self.START = None #first left hand side
+        self._lhs = None
+        self._rhs = []
+
+        self._type = shared_enums(self.debug)[2]
         self._expected_state = []
+        self.calls = 0 #_node calls of the last execute with stats on
+        self._counting = False
         self.output = []
 
+    def _node(self, data, node_type):
+        """
+        New parse tree node, None when no tree is built. Every recognizer
+        step asks for one, so this is where parser calls are counted.
+        """
+        global tree
+        if self._counting:
+            self.calls += 1
+        if self.build_tree:
+            if tree is None:
+                from pylibs.data_structures import tree
+            return tree.Node(data, node_type)
+        return None
+
+    def _add_child(self, node, child):
+        """
+        Attach child to node when a tree is built
+        """
+        if node is not None:
+            node.add_child(child)
+
     @simplelog.dump_func()
     def next_word(self):
         """
         get next word
         """
-        word = self.input_scan[self.index]
+        word = next(self._tokens)
         self.index += 1
         self.word = word
         return self.word #FIXME: this is only for debugging
@@ -307,7 +415,7 @@ class Parser(CompilerBase):
         valid, result= self.is_production_list()
         if (valid):
             self.ast = result 
-            if(self.word["type"] == self.TOKENS.EOF):
+            if(self.word.type == self.TOKENS.EOF):
                 self._expected_state.pop()
                 return True
         return self.fail()
@@ -318,18 +426,18 @@ class Parser(CompilerBase):
         Check if a word is a production list
         ProductionList -> ProductionSet SEMICOLON ProductionList'
         """
-        pl_node = tree.Node("", self._state.PRODUCTIONLIST)
+        pl_node = self._node("", self._state.PRODUCTIONLIST)
         self._expected_state.append(self._state.PRODUCTIONLIST)
 
         valid, result = self.is_production_set()
         if (valid):
-            pl_node.add_child(result)
-            if (self.word["type"] == self.TOKENS.SEMICOLON):
-                pl_node.add_child(tree.Node(";", self.TOKENS.SEMICOLON))
+            self._add_child(pl_node, result)
+            if (self.word.type == self.TOKENS.SEMICOLON):
+                self._add_child(pl_node, self._node(";", self.TOKENS.SEMICOLON))
                 self.next_word()
                 valid, result = self.is_production_list_p()
                 if (valid):
-                    pl_node.add_child(result)
+                    self._add_child(pl_node, result)
                     self._expected_state.pop()
                     return (True, pl_node)
         return self.fail()
@@ -340,21 +448,21 @@ class Parser(CompilerBase):
         ProductionList' -> ProductionSet SEMICOLON ProductionSet'
                         | EPSILON
         """
-        plp_node = tree.Node("", self._state.PRODUCTIONLIST_P)
+        plp_node = self._node("", self._state.PRODUCTIONLIST_P)
         valid, result = self.is_epsilon()
         if (valid):
-            plp_node.add_child(result)
+            self._add_child(plp_node, result)
             return (True, plp_node)
         else:
             valid, result = self.is_production_set()
             if (valid):
-                plp_node.add_child(result)
-                if (self.word['type'] == self.TOKENS.SEMICOLON):
-                    plp_node.add_child(tree.Node(";", self.TOKENS.SEMICOLON))
+                self._add_child(plp_node, result)
+                if (self.word.type == self.TOKENS.SEMICOLON):
+                    self._add_child(plp_node, self._node(";", self.TOKENS.SEMICOLON))
                     self.next_word()
                     valid, result = self.is_production_list_p()
                     if (valid):
-                        plp_node.add_child(result)
+                        self._add_child(plp_node, result)
                         return (True, plp_node)
         return self.fail()
 
@@ -364,21 +472,24 @@ class Parser(CompilerBase):
         Check if word is a production set
         ProductionSet -> SYMBOL DERIVES RightHandSide PS'
         """
-        ps_node = tree.Node("", self._state.PRODUCTIONSET)
+        ps_node = self._node("", self._state.PRODUCTIONSET)
         self._expected_state.append(self._state.PRODUCTIONSET)
 
-        if (self.word["type"] == self.TOKENS.SYMBOL):
-            ps_node.add_child(tree.Node(self.word["value"],self.TOKENS.SYMBOL)) 
+        if (self.word.type == self.TOKENS.SYMBOL):
+            self._add_child(ps_node, self._node(self.word.value,self.TOKENS.SYMBOL)) 
+            self._lhs = intern(self.word.value)
+            if self.START is None:
+                self.START = self._lhs
             self.next_word()
-            if (self.word["type"] == self.TOKENS.DERIVES):
-                ps_node.add_child(tree.Node(":", self.TOKENS.DERIVES))
+            if (self.word.type == self.TOKENS.DERIVES):
+                self._add_child(ps_node, self._node(":", self.TOKENS.DERIVES))
                 self.next_word()
                 valid, result = self.is_right_hand_side()
                 if (valid):
-                    ps_node.add_child(result)
+                    self._add_child(ps_node, result)
                     valid, result = self.is_production_set_p()
                     if (valid):
-                        ps_node.add_child(result)
+                        self._add_child(ps_node, result)
                         self._expected_state.pop()
                         return (True, ps_node)
         return self.fail()
@@ -389,23 +500,23 @@ class Parser(CompilerBase):
         ProductionSet' -> ALSODERIVES PS'
                         | EPSILON
         """
-        psp_node = tree.Node("", self._state.PRODUCTIONSET_P)
+        psp_node = self._node("", self._state.PRODUCTIONSET_P)
         self._expected_state.append(self._state.PRODUCTIONSET_P)
 
         valid, result = self.is_epsilon()
         if(valid):
-            psp_node.add_child(result)
+            self._add_child(psp_node, result)
             self._expected_state.pop()
             return (True, psp_node)
-        elif (self.word["type"] == self.TOKENS.ALSODERIVES):
-            psp_node.add_child(tree.Node("|", self.TOKENS.ALSODERIVES))
+        elif (self.word.type == self.TOKENS.ALSODERIVES):
+            self._add_child(psp_node, self._node("|", self.TOKENS.ALSODERIVES))
             self.next_word()
             valid, result = self.is_right_hand_side()
             if (valid):
-                psp_node.add_child(result)
+                self._add_child(psp_node, result)
                 valid, result = self.is_production_set_p()
                 if(valid):
-                    psp_node.add_child(result)
+                    self._add_child(psp_node, result)
                     self._expected_state.pop()
                     return (True, psp_node)
         return self.fail()
@@ -417,19 +528,22 @@ class Parser(CompilerBase):
         RH -> Symbolist 
             | Epsilon
         """
-        rh_node = tree.Node("", self._state.RIGHTHANDSIDE)
+        rh_node = self._node("", self._state.RIGHTHANDSIDE)
         self._expected_state.append(self._state.RIGHTHANDSIDE)
+        self._rhs = []
 
         valid, result = self.is_epsilon()
         if(valid):
-            rh_node.add_child(result)
+            self._add_child(rh_node, result)
             self.next_word() #epsilon consumes input in right hand side
             self._expected_state.pop()
+            self.IR[self._lhs].append(())
             return (True, rh_node)
         valid, result = self.is_symbol_list()
-        if (valid) or (self.word["type"] == self.TOKENS.EPSILON):
-            rh_node.add_child(result)
+        if (valid) or (self.word.type == self.TOKENS.EPSILON):
+            self._add_child(rh_node, result)
             self._expected_state.pop()
+            self.IR[self._lhs].append(tuple(self._rhs))
             return (True, rh_node)
         return self.fail()
 
@@ -440,14 +554,15 @@ class Parser(CompilerBase):
         Check if word is valid symbolist
         SL ->  SYMBOL SL'
         """
-        sl_node = tree.Node("", self._state.SYMBOLLIST)
+        sl_node = self._node("", self._state.SYMBOLLIST)
         self._expected_state.append(self._state.SYMBOLLIST)
-        if (self.word["type"] == self.TOKENS.SYMBOL):
-            sl_node.add_child(tree.Node(self.word["value"], self.TOKENS.SYMBOL))
+        if (self.word.type == self.TOKENS.SYMBOL):
+            self._add_child(sl_node, self._node(self.word.value, self.TOKENS.SYMBOL))
+            self._rhs.append(intern(self.word.value))
             self.next_word()
             valid, result = self.is_symbol_list_p()
             if (valid):
-                sl_node.add_child(result)
+                self._add_child(sl_node, result)
                 self._expected_state.pop()
                 return (True, sl_node)
         return self.fail()
@@ -459,18 +574,19 @@ class Parser(CompilerBase):
         SL' -> SYMBOL SL'
             | EPSILON
         """
-        slp_node = tree.Node("", self._state.SYMBOLLIST_P)
+        slp_node = self._node("", self._state.SYMBOLLIST_P)
         valid, result = self.is_epsilon()
         if (valid):
-            slp_node.add_child(result)
+            self._add_child(slp_node, result)
             return (True, slp_node)
-        elif (self.word["type"] == self.TOKENS.SYMBOL):
-            slp_node.add_child(tree.Node(self.word["value"],
+        elif (self.word.type == self.TOKENS.SYMBOL):
+            self._add_child(slp_node, self._node(self.word.value,
                                 self.TOKENS.SYMBOL)) 
+            self._rhs.append(intern(self.word.value))
             self.next_word()
             valid, result = self.is_symbol_list_p()
             if (valid):
-                slp_node.add_child(result)
+                self._add_child(slp_node, result)
                 return (True, slp_node)
         return self.fail()
 
@@ -479,26 +595,26 @@ class Parser(CompilerBase):
         Check if word is epsilon
         """
         #ASSUME: RHS has to be a epsilon production
-        empty_node = tree.Node("", "")
+        empty_node = self._node("", "")
         if (self.expected_state == self._state.RHS):
-            assert (self.word["type"] == self.TOKENS.EPSILON)
-        if (self.word["type"] == self.TOKENS.EPSILON):
-            epsilon = tree.Node("EPSILON", self.TOKENS.EPSILON)
+            assert (self.word.type == self.TOKENS.EPSILON)
+        if (self.word.type == self.TOKENS.EPSILON):
+            epsilon = self._node("EPSILON", self.TOKENS.EPSILON)
             return (True, epsilon)
         elif (self.expected_state == self._state.SYMBOLLIST):
             if ( 
-                (self.word["type"] == self.TOKENS.SEMICOLON) | 
-                (self.word["type"] == self.TOKENS.ALSODERIVES)
+                (self.word.type == self.TOKENS.SEMICOLON) | 
+                (self.word.type == self.TOKENS.ALSODERIVES)
                ):
                 return (True, empty_node)
         elif (
                 (self.expected_state == self._state.PRODUCTIONSET) |
                 (self.expected_state == self._state.PRODUCTIONSET_P)
              ):
-            if (self.word["type"] == self.TOKENS.SEMICOLON):
+            if (self.word.type == self.TOKENS.SEMICOLON):
                 return (True, empty_node)
         elif (self.expected_state == self._state.PRODUCTIONLIST):
-            if (self.word["type"] == self.TOKENS.EOF):
+            if (self.word.type == self.TOKENS.EOF):
                 return (True, empty_node)
         return (False, empty_node)
 
@@ -514,9 +630,9 @@ class Parser(CompilerBase):
         error_msg += "error!\n"
         error_msg += "expected: " + str(self._state.get_key_for_value(self.expected_state)) +\
                      "\n"
-        error_msg += "got: " + str(self.TOKENS.get_key_for_value(word["type"])) + "\n"
-        error_msg += "line number: " + str(word["lino"]) + "\n"
-        error_msg += "word: " + word['value'] + "\n"
+        error_msg += "got: " + str(self.TOKENS.get_key_for_value(word.type)) + "\n"
+        error_msg += "line number: " + str(word.lino) + "\n"
+        error_msg += "word: " + word.value + "\n"
         print (error_msg) 
         print (self.input_raw)
         from pprint import pprint
@@ -527,11 +643,25 @@ class Parser(CompilerBase):
         return False
 
     @simplelog.dump_func()
+    @stats.timed("parse")
     def execute(self):
         """
         Run parser
         """
-        if self.is_grammar():
+        collector = stats.current()
+        if collector is None:
+            valid = self.is_grammar()
+        else:
+            self.calls = 0
+            self._counting = True
+            try:
+                valid = self.is_grammar()
+            finally:
+                self._counting = False
+            collector.count("parser_calls", self.calls)
+        if valid:
+            if not self.build_tree:
+                return (True, self.IR)
             return (True, self.ast)
         else:
             return self.fail()
@@ -548,6 +678,107 @@ class Parser(CompilerBase):
             return []
 
 
+class ParseError(Exception):
+    """
+    Raised by LL1Parser for input the grammar does not derive and by
+    Scanner for characters no token starts with
+    """
+    pass
+
+
+class LL1Parser(CompilerBase):
+    """
+    Table driven LL(1) parser. Keeps pending symbols on an explicit
+    stack, so nesting depth is bounded by memory, not by the recursion
+    limit. Tables come from table_generator.TableGenerator.
+    """
+    def __init__(self, table, input_scan, terminals = None):
+        """
+        @param:
+        table - table_generator.ParseTable
+        input_scan - iterable of Token
+        terminals - dict of token type -> terminal name, tokens of other
+                    types are matched by their value
+        """
+        super(LL1Parser, self).__init__()
+        self.table = table
+        self._tokens = iter(input_scan)
+        self.word = None
+        self.derivation = array.array("i")
+
+        #token type -> column, resolved once instead of per token
+        self._type_column = {self.TOKENS.EOF: table.EOF_COLUMN}
+        for token_type, name in (terminals or {}).iteritems():
+            if name in table.column:
+                self._type_column[token_type] = table.column[name]
+        #right hand sides in the order they get pushed
+        self._pushes = [tuple(reversed(rhs)) for _, rhs in table.productions]
+
+    def _column(self, word):
+        """
+        Table column of a token
+        """
+        try:
+            return self._type_column[word.type]
+        except KeyError:
+            try:
+                return self.table.column[word.value]
+            except KeyError:
+                self.fail(None, word)
+
+    @stats.timed("ll1")
+    def execute(self):
+        """
+        Run parser
+        @return:
+        tuple object (True, derivation), derivation lists the productions
+        of the leftmost derivation in order
+        """
+        table = self.table.table
+        width = self.table.width
+        pushes = self._pushes
+        derivation = self.derivation
+        tokens = self._tokens
+        stack = [-1] #start symbol, nonterminal codes are -(index + 1)
+
+        word = next(tokens)
+        column = self._column(word)
+        while stack:
+            top = stack.pop()
+            if top >= 0:
+                if top != column:
+                    self.fail(top, word)
+                word = next(tokens)
+                column = self._column(word)
+            else:
+                number = table[(-top - 1) * width + column]
+                if number < 0:
+                    self.fail(top, word)
+                derivation.append(number)
+                stack.extend(pushes[number])
+        if column != self.table.EOF_COLUMN:
+            self.fail(self.table.EOF_COLUMN, word)
+        self.word = word
+        collector = stats.current()
+        if collector is not None:
+            collector.count("expansions", len(derivation))
+        return (True, derivation)
+
+    def fail(self, expected, word):
+        """
+        Raise a ParseError describing the unexpected word
+        """
+        if expected is None:
+            what = "a terminal of the grammar"
+        elif expected >= 0:
+            what = (["EOF"] + [str(t) for t in
+                                self.table.terminals])[expected]
+        else:
+            what = self.table.nonterminals[-expected - 1]
+        raise ParseError("line {0}: expected {1}, got {2!r}".format(
+                            word.lino, what, word.value))
+
+
                 
 
 
@@ -0,0 +1,39 @@
+"""
+Prebuilt scanner tables for compiler.Scanner, generated by
+automata.write_module. Do not edit, run python automata.py
+after changing the token spec.
+"""
+
+VERSION = 1
+SPEC = ((0, ';'), (1, ':'), (2, '\\|'), (3, 'EPSILON|[Ee]psilon'), (4, '[a-zA-Z0-9]+'))
+CLASSIFIER = '\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01\x01\x01\x01\x01\x01\x01\x01\x01\x01\x02\x03\x00\x00\x00\x00\x00\x01\x01\x01\x01\x04\x01\x01\x01\x05\x01\x01\x06\x01\x07\x08\t\x01\x01\n\x01\x01\x01\x01\x01\x01\x01\x00\x00\x00\x00\x00\x00\x01\x01\x01\x01\x0b\x01\x01\x01\x0c\x01\x01\r\x01\x0e\x0f\x10\x01\x01\x11\x01\x01\x01\x01\x01\x01\x01\x00\x12\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+TRANSITION = (
+    -1, 1, 2, 3, 4, 1, 1, 1, 1, 1, 1, 5, 1, 1, 1, 1,
+    1, 1, 6, -1, 1, -1, -1, 1, 1, 1, 1, 1, 1, 1, 1, 1,
+    1, 1, 1, 1, 1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1,
+    -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1,
+    -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, 1, -1, -1,
+    1, 1, 1, 1, 1, 7, 1, 1, 1, 1, 1, 1, 8, 1, -1, -1,
+    1, -1, -1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 8,
+    1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1,
+    -1, -1, -1, -1, -1, -1, 1, -1, -1, 1, 1, 1, 1, 1, 1, 9,
+    1, 1, 1, 1, 1, 1, 1, -1, -1, 1, -1, -1, 1, 1, 1, 1,
+    1, 1, 1, 1, 1, 1, 1, 1, 1, 10, -1, -1, 1, -1, -1, 1,
+    11, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, -1, -1, 1,
+    -1, -1, 1, 1, 1, 1, 1, 1, 1, 1, 12, 1, 1, 1, 1, 1,
+    -1, -1, 1, -1, -1, 1, 1, 13, 1, 1, 1, 1, 1, 1, 1, 1,
+    1, 1, 1, -1, -1, 1, -1, -1, 1, 1, 1, 1, 1, 1, 1, 1,
+    1, 14, 1, 1, 1, 1, -1, -1, 1, -1, -1, 1, 1, 1, 1, 15,
+    1, 1, 1, 1, 1, 1, 1, 1, 1, -1, -1, 1, -1, -1, 1, 1,
+    1, 1, 1, 1, 1, 1, 1, 1, 1, 16, 1, 1, -1, -1, 1, -1,
+    -1, 1, 1, 1, 17, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, -1,
+    -1, 1, -1, -1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 17, 1,
+    1, 1, -1, -1, 1, -1, -1, 1, 1, 1, 1, 1, 1, 1, 1, 1,
+    1, 1, 1, 1, 1, -1,
+)
+ACCEPT = (
+    -1, 0, 1, 2, 0, 0, 3, 0, 0, 0, 0, 0, 0, 0, 0, 0,
+    0, 4,
+)
+TOKENS = (4, 1, 0, 2, 3)
+NUM_CLASSES = 19
@@ -10,6 +10,10 @@ Modules:
 -------
 __init__.py
     Contains the SimpleLog class
+decorators.py
+    Contains the dump_func tracing decorator
+handlers.py
+    Contains the AsyncHandler background log writer
 
 Subpackages:
 -----------
@@ -32,12 +36,10 @@ __version_details__ = 'alpha release'
 __all__ = ["SimpeLog"]
 
 
-import inspect
 import logging
-import logging.config
-import logging.handlers
 import os
 from decorators import *
+from handlers import *
 
 
 
@@ -54,11 +56,16 @@ class SimpleLog(logging.Logger):
     fname - filepath, defaults to <cwd>/simplelog.log
     path - default is current directory, 'tmp' puts log in /tmp folder
     verbose - if true, prints very detailed messages in dump
+    async_log - if true, the log file is written by a background thread in
+                batches, see handlers.AsyncHandler
+    async_options - keyword arguments for the AsyncHandler, e.g. capacity
+                    or overflow
     @return:
     simple log logger object
     """
     def __init__(self, name="simplelog", level=logging.NOTSET, 
-                    path = None, verbose = False):        
+                    path = None, verbose = False, async_log = False,
+                    async_options = None):        
         super(SimpleLog, self).__init__(name, level)
 
         if (path == None):
@@ -68,19 +75,25 @@ class SimpleLog(logging.Logger):
         #State
         self.DIVIDER = "=========="
         self.path = path
+        self.async_log = async_log
+        self.async_options = async_options
         self.sl_debug = logging.getLogger('alog')
 
         self.sh = logging.StreamHandler()
         self.sh.setFormatter(SIMPLE_FORMATTER)
 
-        fh = logging.FileHandler(filename=path)
+        fh = logging.FileHandler(filename=path, delay=True) #opened on first write
         fh.setFormatter(SIMPLE_FORMATTER)
+        if async_log:
+            fh = AsyncHandler(fh, **(async_options or {}))
+        self.fh = fh
 
         self.setLevel(logging.DEBUG)
         self.addHandler(self.sh)
         self.addHandler(fh) #TODO: don't have this here
         
         #TODO: make this work
+        #alog shares the file handler, so messages are not forwarded to it
         self.sl_debug.setLevel(logging.DEBUG)
         self.sl_debug.addHandler(fh)
 
@@ -89,13 +102,26 @@ class SimpleLog(logging.Logger):
         Dispale simplelog
         """
         self.handlers = [] #could this result in a memory leak?
+        self.disabled = True
         assert(self.handlers == [])
     
     def enable(self):
         """
-        Enable simplelog
+        Enable simplelog, the handlers are reused so nothing is written
+        twice after several disable and enable calls
         """
-        self.__init__(path = self.path)
+        self.addHandler(self.sh)
+        self.addHandler(self.fh)
+        self.disabled = False
+
+    def close(self):
+        """
+        Write out and close the file handler, detaching it from this log
+        and alog
+        """
+        self.disable()
+        self.sl_debug.removeHandler(self.fh)
+        self.fh.close()
 
     def quiet(self):
         """
@@ -103,9 +129,20 @@ class SimpleLog(logging.Logger):
         """
         self.removeHandler(self.sh)
         
-    def log(self, level, msg, *args, **kwargs):
-        super(SimpleLog, self).log(level, msg, *args, **kwargs)
-        self.sl_debug.log(level, msg, *args, **kwargs)
+    def tracing(self, level = logging.DEBUG):
+        """
+        Check if a message at level would be written anywhere.
+        Cheap enough to call before building trace messages.
+        """
+        return (not self.disabled) and bool(self.handlers) and \
+                self.isEnabledFor(level)
+
+    def trace(self, level, msg, *args):
+        """
+        Log to this logger only, msg is formatted when it gets written
+        """
+        if self.isEnabledFor(level):
+            self._log(level, msg, args)
 
     def dump(self, var_name):
         """
@@ -127,8 +164,41 @@ class SimpleLog(logging.Logger):
         return self.config
 
 
+class _LazyLog(object):
+    """
+    Stands in for the SimpleLog singleton and creates it on first use,
+    importing simplelog doesn't set up any handlers
+    """
+    def __init__(self, factory):
+        self.__dict__["_factory"] = factory
+        self.__dict__["_log"] = None
+
+    def _get(self):
+        log = self.__dict__["_log"]
+        if log is None:
+            log = self.__dict__["_log"] = self._factory()
+        return log
+
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._get(), name, value)
+
+    def __repr__(self):
+        return repr(self._get())
+
+
+def instance():
+    """
+    The SimpleLog singleton itself, for callers that keep a reference
+    and want to skip the proxy
+    """
+    return sl._get()
+
+
 #Singleton instance 
-sl = SimpleLog(path="/tmp/simplelog.log")
+sl = _LazyLog(lambda: SimpleLog(path="/tmp/simplelog.log"))
 
 if __name__ == "__main__":
     print(sl)
@@ -1,70 +1,108 @@
 """
 This module holds decorators used for simplelog.
+
+Tracing can be switched off for good by setting the environment variable
+SIMPLELOG_TRACE=0 before the decorated modules are imported, dump_func
+then returns functions undecorated.
 """
 
 import functools
+import logging
+import os
 import sys
+import traceback
 
 __all__ = ["dump_func"]
 
+TRACE = os.environ.get("SIMPLELOG_TRACE", "1") != "0"
+
+_sl = None #simplelog singleton, fetched on first call
+
+
+def _logger():
+    """
+    Get the simplelog singleton.
+    Imported lazily since simplelog imports this module.
+    """
+    global _sl
+    if _sl is None:
+        import simplelog
+        _sl = simplelog.instance()
+        _sl.quiet()
+    return _sl
+
+
+class _CallRecord(object):
+    """
+    Log message for a function call, formatted only when a handler
+    actually writes it
+    """
+    __slots__ = ("func_name", "args", "kwargs", "result", "error", "pretty")
+
+    def __init__(self, func_name, args, kwargs, result, error, pretty):
+        self.func_name = func_name
+        self.args = args
+        self.kwargs = kwargs
+        self.result = result
+        self.error = error
+        self.pretty = pretty
+
+    def __str__(self):
+        log = "function: " + self.func_name + "\n"
+        if self.args is not None:
+            log += "args: "
+            log += ", ".join(["{0!r}".format(a) for a in self.args])
+            log += "\n"
+            log += "kwargs: "
+            log += ", ".join(["{0!r}".format(a) for a in self.kwargs])
+            log += "\n"
+        if self.error is None:
+            log += ("result: " + str(self.result))
+        else:
+            log += "exception: " + self.error
+        if self.pretty:
+            log += "\n==============\n"
+        return log
+
+
 def dump_func(level = None, func_name_only = False, pretty = True):
     """
     This decorate captures the input values of a particular function
     @param:
-    level - debug level
+    level - log level of the message, defaults to debug
+    func_name_only - if true, don't log the arguments
+    pretty - if true, add a divider after each message
     """
-    #TODO: make the level actually do something useful
-    #TODO: don't return result in func_name_only
+    if level is None:
+        level = logging.DEBUG
+    elif not isinstance(level, int):
+        level = logging.getLevelName(level)
+
     def decorator(function):
-        @functools.wraps(function) #propagate docstring to children 
+        if not TRACE:
+            return function
+        func_name = function.__name__
+
+        @functools.wraps(function) #propagate docstring to children
         def wrapper(*args, **kwargs):
+            sl = _sl or _logger()
+            if not sl.tracing(level):
+                return function(*args, **kwargs)
 
-            log = ""
-            func_name = function.__name__
-            log += "function: " + func_name + "\n"
-            if not func_name_only:
-                log += "args: "
-                log += ", ".join(["{0!r}".format(a) for a in args]) 
-                log += "\n"
-                log += "kwargs: " 
-                log += ", ".join(["{0!r}".format(a) for a in kwargs]) 
-                log += "\n"
-            result = exception = None
-
-            #get result or error
+            if func_name_only:
+                call_args = call_kwargs = None
+            else:
+                call_args, call_kwargs = args, kwargs
             try:
                 result = function(*args, **kwargs)
             except Exception as err:
-                exception = err
-            finally: 
-                if exception is None:
-                    log += ("result: " + str(result))
-                else:
-                    import traceback
-                    log += ("exception: {0}:{1}".format(type(exception),
-                                exception))
-                    log += ("{0}".format(traceback.format_exc()))
-
-                if pretty:
-                    log += "\n==============\n"
-
-                #Log message
-                try:
-                    if level:
-                        print ("level is " + level)
-                    sl = globals()['sl']
-                    sl.debug(log)
-                except KeyError:
-                    import simplelog
-                    sl = simplelog.sl
-                    sl.quiet()
-                    sl.debug(log)
-                    pass
-                finally:    
-                    if exception: #FIXME: put somewhere better
-                        raise exception
-                    return result
+                error = "{0}:{1}\n{2}".format(type(err), err,
+                                              traceback.format_exc())
+                sl.trace(level, "%s", _CallRecord(func_name, call_args,
+                                      call_kwargs, None, error, pretty))
+                raise
+            sl.trace(level, "%s", _CallRecord(func_name, call_args,
+                                  call_kwargs, result, None, pretty))
+            return result
         return wrapper
     return decorator
-
-
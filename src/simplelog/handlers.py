@@ -0,0 +1,135 @@
+"""
+This module holds log handlers used for simplelog.
+"""
+
+import atexit
+import logging
+import Queue
+import threading
+import weakref
+
+__all__ = ["AsyncHandler"]
+
+_live = weakref.WeakSet() #open handlers, closed at exit
+
+
+def _close_all():
+    for handler in list(_live):
+        handler.close()
+
+atexit.register(_close_all)
+
+
+class AsyncHandler(logging.Handler):
+    """
+    Hands records to a background thread which formats them and writes
+    them to the target handler in batches, so logging never waits on io.
+
+    @param:
+    target - handler doing the actual output, e.g. a FileHandler
+    capacity - maximum number of queued records
+    batch_size - maximum number of records written at once
+    interval - seconds the writer waits for more records before flushing
+    overflow - "drop" discards records while the queue is full,
+               "sample" starts keeping only every sample_rate-th record
+               once the queue is half full
+    sample_rate - see overflow
+    """
+    def __init__(self, target, capacity = 10000, batch_size = 256,
+                    interval = 0.5, overflow = "drop", sample_rate = 10):
+        super(AsyncHandler, self).__init__()
+        if overflow not in ("drop", "sample"):
+            raise ValueError("overflow must be 'drop' or 'sample'")
+        self.target = target
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.interval = interval
+        self.overflow = overflow
+        self.sample_rate = sample_rate
+        self.dropped = 0 #records lost under pressure
+        self._seen = 0
+        self._queue = Queue.Queue(capacity)
+        self._stop = object() #sentinel, ends the writer
+        self._thread = threading.Thread(target = self._writer,
+                                        name = "simplelog-writer")
+        self._thread.daemon = True
+        self._thread.start()
+        _live.add(self)
+
+    def emit(self, record):
+        """
+        Queue the record, never blocks
+        """
+        if self.overflow == "sample" and \
+                self._queue.qsize() >= self.capacity // 2:
+            self._seen += 1
+            if self._seen % self.sample_rate:
+                self.dropped += 1
+                return
+        try:
+            self._queue.put_nowait(record)
+        except Queue.Full:
+            self.dropped += 1
+
+    def _writer(self):
+        """
+        Background loop, drains the queue in batches
+        """
+        while True:
+            try:
+                batch = [self._queue.get(timeout = self.interval)]
+            except Queue.Empty:
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except Queue.Empty:
+                    break
+            stop = batch[-1] is self._stop
+            if stop:
+                batch.pop()
+            self._write(batch)
+            if stop:
+                return
+
+    def _write(self, batch):
+        """
+        Format the batch and write it with a single call when the target
+        is a stream handler, records the target's level or filters reject
+        are skipped
+        """
+        if self.target.level: #the check a logger does before handle
+            batch = [record for record in batch
+                     if record.levelno >= self.target.level]
+        if not batch:
+            return
+        stream = getattr(self.target, "stream", None)
+        if stream is None:
+            for record in batch:
+                self.target.handle(record)
+            return
+        lines = []
+        for record in batch:
+            if not self.target.filter(record):
+                continue #as target.handle would
+            try:
+                lines.append(self.target.format(record) + "\n")
+            except Exception:
+                self.handleError(record)
+        self.target.acquire()
+        try:
+            stream.write("".join(lines))
+            self.target.flush()
+        finally:
+            self.target.release()
+
+    def close(self):
+        """
+        Write out everything queued and stop the writer
+        """
+        _live.discard(self)
+        if self._thread.is_alive():
+            self._queue.put(self._stop)
+            self._thread.join()
+        self.target.close()
+        super(AsyncHandler, self).close()
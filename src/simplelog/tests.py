@@ -1,5 +1,11 @@
+import gc
+import logging
+import os
 import simplelog
+import tempfile
+import threading
 import unittest
+import weakref
 
 
 class TestSimpleLog(unittest.TestCase):
@@ -14,6 +20,87 @@ class TestSimpleLog(unittest.TestCase):
         self.assertTrue(self.sl.handlers == [])
 
 
+class TestAsyncHandler(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        self.log = simplelog.SimpleLog(name = "async", path = self.path,
+                                        async_log = True)
+        self.log.quiet()
+
+    def test_batched_write(self):
+        for i in xrange(1000):
+            self.log.info("message %d", i)
+        self.log.close()
+        with open(self.path) as fh:
+            lines = fh.read().splitlines()
+        self.assertTrue(len(lines) == 1000)
+        self.assertTrue(lines[-1].endswith("message 999"))
+
+    def test_overflow_drop(self):
+        """
+        Records are dropped instead of blocking while the writer is stuck
+        """
+        class Blocked(logging.Handler):
+            def __init__(self):
+                logging.Handler.__init__(self)
+                self.gate = threading.Event()
+                self.records = []
+            def emit(self, record):
+                self.gate.wait()
+                self.records.append(record)
+        target = Blocked()
+        handler = simplelog.AsyncHandler(target, capacity = 2)
+        for i in xrange(100):
+            handler.emit(logging.makeLogRecord({"msg": str(i)}))
+        target.gate.set()
+        handler.close()
+        self.assertTrue(handler.dropped > 0)
+        self.assertTrue(len(target.records) + handler.dropped == 100)
+
+    def test_filtered(self):
+        """
+        The target's level applies to queued records
+        """
+        self.log.fh.target.setLevel(logging.WARNING)
+        self.log.info("dropped")
+        self.log.warning("kept")
+        self.log.close()
+        with open(self.path) as fh:
+            lines = fh.read().splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertTrue(lines[0].endswith("kept"))
+
+    def test_enable_cycles(self):
+        """
+        Records are written once after disable and enable
+        """
+        for _ in xrange(3):
+            self.log.disable()
+            self.log.enable()
+        self.log.quiet()
+        self.log.info("once")
+        self.log.close()
+        with open(self.path) as fh:
+            self.assertEqual(len(fh.read().splitlines()), 1)
+
+    def test_closed_released(self):
+        """
+        Nothing keeps a closed handler alive
+        """
+        handler = simplelog.AsyncHandler(logging.StreamHandler())
+        self.assertTrue(handler in simplelog.handlers._live)
+        handler.close()
+        ref = weakref.ref(handler)
+        del handler
+        gc.collect()
+        self.assertTrue(ref() is None)
+
+    def tearDown(self):
+        self.log.close()
+        os.remove(self.path)
+
+
 @simplelog.dump_func()
 def func1(arg1, arg2):
     """
@@ -29,3 +116,16 @@ class TestDecorators(unittest.TestCase):
 
         return
 
+    def test_dump_func_disabled(self):
+        """
+        Arguments are never formatted while tracing is off
+        """
+        calls = []
+        class Arg(object):
+            def __repr__(self):
+                calls.append(self)
+                return "Arg"
+        self.sl.disable()
+        func1(Arg(), Arg())
+        self.assertTrue(calls == [])
+
@@ -0,0 +1,191 @@
+"""
+Timing and counters for the scanner, parsers and table generator.
+
+Nothing is collected unless a Stats object is active:
+
+    with stats.collect() as collected:
+        table_generator.generate("grammar.txt")
+    print(collected.report())
+
+Stages are the methods decorated with timed and the token stream of
+Scanner.iter_tokens. Counters are added by the instrumented code once per
+call rather than per character or token, when nothing is collected the
+cost is one global lookup per stage. Scanner.next_word, which reads a
+single word outside of any stage, is not measured.
+"""
+
+import collections
+import contextlib
+import functools
+import resource
+import StringIO
+import time
+
+__all__ = ["Stats", "collect", "current", "timed"]
+
+_current = None #active Stats
+
+
+class Stats(object):
+    """
+    Collected measurements
+
+    seconds - stage -> wall time, summed over calls. Nested stages count
+              in their outer stage too, e.g. the scanning a parser pulls
+              tokens from is part of its parse time.
+    runs - stage -> number of calls
+    counters - name -> count, e.g. tokens, dfa_steps, rollbacks,
+               parser_calls, first_iterations, follow_iterations.
+               dfa_steps are characters the scanner read, rollbacks the
+               ones it read past the longest match and reads again.
+    peak_memory_kb - peak resident memory of the process at the end of
+                     the last stage
+    profiler - cProfile.Profile running during stages, None if profiling
+               is off
+    """
+    def __init__(self, profile = False):
+        self.seconds = collections.OrderedDict()
+        self.runs = collections.Counter()
+        self.counters = collections.Counter()
+        self.peak_memory_kb = 0
+        self.profiler = None
+        if profile:
+            import cProfile
+            self.profiler = cProfile.Profile()
+        self._depth = 0 #stages in progress
+
+    def count(self, name, n = 1):
+        self.counters[name] += n
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Time a stage, the profiler runs while any stage does
+        """
+        if self.profiler is not None and not self._depth:
+            self.profiler.enable()
+        self._depth += 1
+        start = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start
+            self._depth -= 1
+            if self.profiler is not None and not self._depth:
+                self.profiler.disable()
+            self._add(name, elapsed)
+
+    def timed_iter(self, name, iterable):
+        """
+        Pass the items of iterable through, the time spent producing them
+        goes to stage name, e.g. tokens pulled lazily by a parser
+        """
+        iterator = iter(iterable)
+        elapsed = 0.0
+        try:
+            while True:
+                start = time.time()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed += time.time() - start
+                yield item
+        finally:
+            self._add(name, elapsed)
+
+    def _add(self, name, elapsed):
+        """
+        Record one run of a stage
+        """
+        self.seconds[name] = self.seconds.get(name, 0.0) + elapsed
+        self.runs[name] += 1
+        self.peak_memory_kb = resource.getrusage(
+                                    resource.RUSAGE_SELF).ru_maxrss
+
+    def tokens_per_second(self):
+        """
+        Scanner throughput, None if nothing was scanned
+        """
+        seconds = self.seconds.get("scan")
+        if not seconds:
+            return None
+        return self.counters["tokens"] / seconds
+
+    def as_dict(self):
+        """
+        Measurements as plain dicts, e.g. for json
+        """
+        return {"seconds": dict(self.seconds), "runs": dict(self.runs),
+                "counters": dict(self.counters),
+                "tokens_per_second": self.tokens_per_second(),
+                "peak_memory_kb": self.peak_memory_kb}
+
+    def report(self):
+        """
+        Measurements as text
+        """
+        lines = ["%-10s %6s %10s" % ("stage", "runs", "seconds")]
+        for name, seconds in self.seconds.iteritems():
+            lines.append("%-10s %6d %10.4f" % (name, self.runs[name],
+                                               seconds))
+        for name, count in sorted(self.counters.iteritems()):
+            lines.append("%-20s %d" % (name, count))
+        rate = self.tokens_per_second()
+        if rate is not None:
+            lines.append("%-20s %.0f" % ("tokens/s", rate))
+        lines.append("%-20s %d" % ("peak memory KB", self.peak_memory_kb))
+        return "\n".join(lines)
+
+    def profile_report(self, limit = 20, sort = "cumulative"):
+        """
+        The most expensive functions seen by the profiler as text
+        """
+        if self.profiler is None:
+            return ""
+        import pstats
+        out = StringIO.StringIO()
+        pstats.Stats(self.profiler, stream = out).sort_stats(sort) \
+              .print_stats(limit)
+        return out.getvalue()
+
+
+def current():
+    """
+    The active Stats, None when nothing is collected
+    """
+    return _current
+
+
+@contextlib.contextmanager
+def collect(profile = False):
+    """
+    Collect measurements for the code in the with block
+    @param:
+    profile - if true, also run cProfile during stages
+    @return:
+    Stats
+    """
+    global _current
+    outer = _current
+    _current = Stats(profile)
+    try:
+        yield _current
+    finally:
+        _current = outer
+
+
+def timed(name):
+    """
+    Decorator making a function a stage
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _current is None:
+                return function(*args, **kwargs)
+            with _current.stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -5,16 +5,52 @@ LL(1) Table Generator
 
 
 import argparse
+import array
 import collections
+import os
+import StringIO
+import struct
 import sys
 
 import compiler
 import simplelog
+import stats
+import utils
 
 
-p = argparse.ArgumentParser(description = "parser generator", 
+p = argparse.ArgumentParser(prog = "parser_generator",
+                            description = "build LL(1) tables for bnf grammars",
                             formatter_class = argparse.ArgumentDefaultsHelpFormatter)
-p.add_argument('-d', '--declarations', nargs = 1, help = "print declarations to stdout")
+p.add_argument('grammars', nargs = '*', default = ["-"],
+                help = "grammar files or glob patterns, - reads stdin")
+p.add_argument('-o', '--output', default = "-",
+                help = "file for the tables, - writes stdout")
+p.add_argument('-f', '--format', default = "binary",
+                choices = ["binary", "json", "python"],
+                help = "binary: ParseTable.dump of a single grammar, json: "
+                       "one object per line, python: module with a TABLES dict")
+p.add_argument('-j', '--jobs', type = int, default = 1,
+                help = "worker processes for several grammars")
+p.add_argument('--stats', action = 'store_true',
+                help = "print stage times and counters to stderr, needs "
+                       "--jobs 1")
+p.add_argument('--profile', action = 'store_true',
+                help = "like --stats, plus a cProfile report")
+
+EPSILON_BIT = 1 #EPSILON is always terminal 0, see intern_terminals
+
+BNF_GRAMMAR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           "bnf.txt")
+_BNF_TABLE = None
+
+
+def _count(name, n):
+    """
+    Add to a stats counter when stats are collected
+    """
+    collector = stats.current()
+    if collector is not None:
+        collector.count(name, n)
 
 
 class TableGenerator(compiler.CompilerBase):
@@ -32,165 +68,1055 @@ class TableGenerator(compiler.CompilerBase):
         self.IR = collections.defaultdict(list)
         self.FIRST = {}
         self.FOLLOW = {}
+        self.FIRST_BITS = {} #symbol -> bitmask over TERMINALS
+        self.FOLLOW_BITS = {}
+        self.TERMINALS = [] #bit position -> terminal
+        self.TERMINAL_ID = {} #terminal -> bit position
+        self.PRODUCTIONS = [] #tuple object (lhs, rhs)
+        self.PREDICT = [] #production -> bitmask over TERMINALS
+        self.TABLE = None
         #self.SYMBOL_TABLE = {}
 
         self.NT = set()
         self.T = set()
         self.SYM = set()
-        self.PARENT_STATE = collections.deque()
-        self.VISITED = set()
-        self.LHS = ""
-        self.RHS = []
-        
+        self.START = None #first left hand side in the grammar
+
+
+    @classmethod
+    def from_ir(cls, ir, start):
+        """
+        Generator for productions that are already in IR form, such as the
+        output of compiler.Parser without a tree
+        @param:
+        ir - {lhs: [rhs symbols]}
+        start - start symbol
+        """
+        generator = cls(None)
+        generator.IR.update(ir)
+        generator.START = start
+        generator.NT = set(ir)
+        generator.SYM = set(s for p in ir for e in ir[p] for s in e)
+        generator.T = generator.SYM.difference(generator.NT)
+        return generator
 
     def initialize(self):
         """
         Determine terminal and non terminal symbols.
         Also convert representation from parse tree 
-        into hash table
+        into hash table, generators made by from_ir skip this
         """
-        self.classify_symbols()
+        if self.parse_tree is not None:
+            self.classify_symbols()
         self.first_set()
         self.follow_set()
+        self.predict_set()
+        self.build_table()
 
     def classify_symbols(self):
         """
         Classify symbols into terminals and non terminals.
         Build up rule table
         """
-        self.PARENT_STATE = self._state.GRAMMAR
         self.dfs(self.parse_tree)
         self.T = self.SYM.difference(self.NT)
 
+    def intern_terminals(self):
+        """
+        Give every terminal a dense bit position.
+        EPSILON is bit 0 and EOF bit 1.
+        """
+        self.TERMINALS = [self.TOKENS.EPSILON, self.TOKENS.EOF] + \
+                            sorted(self.T)
+        self.TERMINAL_ID = dict((t, i) for i, t in enumerate(self.TERMINALS))
+
+    @stats.timed("first")
     def first_set(self):
         """
-        Find the first set of given grammar
+        Find the first set of given grammar.
+        Worklist algorithm, a nonterminal is only revisited when the first
+        set of a symbol on one of its right hand sides grew. Nullable
+        nonterminals have EPSILON in their first set.
+        Sets are bitmasks over self.TERMINALS in FIRST_BITS, FIRST decodes
+        them on access.
         """
+        self.intern_terminals()
+        bits = self.FIRST_BITS = {}
         for sym in self.T:
-            self.FIRST[sym] = set([sym])
-        self.FIRST[self.TOKENS.EOF] = set([self.TOKENS.EOF])
-        #TODO: epsilon 
+            bits[sym] = 1 << self.TERMINAL_ID[sym]
+        bits[self.TOKENS.EOF] = 1 << self.TERMINAL_ID[self.TOKENS.EOF]
         for sym in self.NT:
-            self.FIRST[sym] = set()
-
-        CHANGING = True
-        while (CHANGING):
-            CHANGING = False
-            for p in self.IR:
-                rhs_old = self.FIRST[p]  #[["baa"], ["sheepnoise"] 
-                rhs = set()
-                productions = self.IR[p]  #Expr'  -> + Term Expr'
-                for expansion in productions:
-                    sl.info("expansion: " + str(expansion))
-                    first = expansion[0]
-                    rhs.update(self.FIRST[first])
-                #TODO: account for epsilon
-                self.FIRST[p].update(rhs)
-                if (rhs_old != rhs): #FIXME: make this more efficient
-                    CHANGING = True
+            bits[sym] = 0
+
+        self._first_fixpoint(self.IR, self._dependents())
+        self.FIRST = utils.BitSets(bits, self.TERMINALS)
         return self.FIRST
 
+    def _first_fixpoint(self, nonterminals, dependents):
+        """
+        Run the first set worklist starting from the given nonterminals
+        """
+        bits = self.FIRST_BITS
+        worklist = collections.deque(nonterminals)
+        queued = set(worklist)
+        iterations = 0
+        while worklist:
+            p = worklist.popleft()
+            queued.discard(p)
+            iterations += 1
+            rhs = 0
+            for expansion in self.IR[p]:
+                rhs |= self.first_bits(expansion)
+            if rhs != bits[p]:
+                bits[p] = rhs
+                for q in dependents[p]:
+                    if q not in queued:
+                        queued.add(q)
+                        worklist.append(q)
+        _count("first_iterations", iterations)
+
+    def first_bits(self, symbols):
+        """
+        First set bitmask of a string of symbols, has the EPSILON bit if
+        every symbol is nullable
+        """
+        result = 0
+        bits = self.FIRST_BITS
+        for sym in symbols:
+            first = bits[sym]
+            result |= first
+            if not first & EPSILON_BIT:
+                return result & ~EPSILON_BIT
+        return result | EPSILON_BIT
+
+    def first_of(self, symbols):
+        """
+        First set of a string of symbols, contains EPSILON if every
+        symbol is nullable
+        """
+        return utils.decode_bits(self.first_bits(symbols), self.TERMINALS)
+
+    @stats.timed("follow")
     def follow_set(self):
         """
-        Find follow set of given grammar
+        Find follow set of given grammar.
+        One pass over the productions collects what follows each
+        nonterminal directly and which follow sets flow into which
+        (A -> x B y with y nullable: FOLLOW(A) flows into FOLLOW(B)),
+        then a worklist propagates only the follow sets that changed.
+        Sets are bitmasks in FOLLOW_BITS, FOLLOW decodes them on access.
         """
-        for sym in self.NT:
-            self.FOLLOW[sym] = set()
-        #TODO: assume start symbol is goal, is this always the case?
-        assert("Goal" in self.FOLLOW)
-        self.FOLLOW["Goal"].add(self.TOKENS.EOF)
-
-        CHANGING = True
-        while (CHANGING):
-            CHANGING = False
-            #TODO: impose order on these productions
-            for p in self.IR:
-                trailer = self.FOLLOW[p]
-                sl.info("trailer is: " + str(trailer))
-                productions = self.IR[p]
-                for expansion in productions:
-                    import pdb
-                    pdb.set_trace()
-                    size = len(expansion)
-                    for i in xrange(size - 1, -1, -1):
-                        symbol = expansion[i]
-                        if (symbol in self.NT):
-                            follow_old = self.FOLLOW[symbol]
-                            self.FOLLOW[symbol].update(trailer)
-                            if (follow_old != self.FOLLOW[symbol]): #FIXME: make more efficient
-                                CHANGING = True
-                                sl.info("found new follow set")
-                            if (self.TOKENS.EPSILON in self.FIRST[symbol]):
-                                trailer.update(self.FIRST[symbol].difference(set([self.TOKENS.EPSILON])))
-                            else:
-                               trailer.update(self.FIRST[symbol])
+        first_bits = self.FIRST_BITS
+        follow_bits = self.FOLLOW_BITS = dict.fromkeys(self.NT, 0)
+        assert(self.START in follow_bits)
+        follow_bits[self.START] = 1 << self.TERMINAL_ID[self.TOKENS.EOF]
+
+        flows = collections.defaultdict(set)
+        for p in self.IR:
+            for expansion in self.IR[p]:
+                trailer = 0
+                nullable = True
+                for symbol in reversed(expansion):
+                    first = first_bits[symbol]
+                    if (symbol in follow_bits):
+                        follow_bits[symbol] |= trailer
+                        if nullable and symbol != p:
+                            flows[p].add(symbol)
+                    if (first & EPSILON_BIT):
+                        trailer |= first & ~EPSILON_BIT
+                    else:
+                        trailer = first
+                        nullable = False
+
+        worklist = collections.deque(self.NT)
+        queued = set(worklist)
+        iterations = 0
+        while worklist:
+            p = worklist.popleft()
+            queued.discard(p)
+            iterations += 1
+            for symbol in flows[p]:
+                follow = follow_bits[symbol] | follow_bits[p]
+                if follow != follow_bits[symbol]:
+                    follow_bits[symbol] = follow
+                    if symbol not in queued:
+                        queued.add(symbol)
+                        worklist.append(symbol)
+        _count("follow_iterations", iterations)
+        self.FOLLOW = utils.BitSets(follow_bits, self.TERMINALS)
+        return self.FOLLOW
+
+    @stats.timed("predict")
+    def predict_set(self):
+        """
+        Number the productions and find their predict sets:
+        FIRST(rhs), plus FOLLOW(lhs) when rhs is nullable.
+        Nonterminals are ordered start symbol first, then by name.
+        """
+        self.PRODUCTIONS = []
+        self.PREDICT = []
+        for lhs in self.nonterminals():
+            for expansion in self.IR[lhs]:
+                predict = self.first_bits(expansion)
+                if predict & EPSILON_BIT:
+                    predict = (predict & ~EPSILON_BIT) | self.FOLLOW_BITS[lhs]
+                self.PRODUCTIONS.append((lhs, tuple(expansion)))
+                self.PREDICT.append(predict)
+        return self.PREDICT
+
+    def nonterminals(self):
+        """
+        Nonterminals in table order, the start symbol comes first
+        """
+        return [self.START] + sorted(self.NT.difference([self.START]))
+
+    @stats.timed("table")
+    def build_table(self):
+        """
+        Fill the LL(1) table from the predict sets. When productions
+        of a nonterminal predict the same terminal, the first one is kept
+        and the clash is recorded in TABLE.conflicts.
+        @return:
+        ParseTable
+        """
+        nonterminals = self.nonterminals()
+        nt_index = dict((nt, i) for i, nt in enumerate(nonterminals))
+        #bit 0 is EPSILON and never predicted, bit 1 (EOF) is column 0
+        terminals = self.TERMINALS[2:]
+        width = len(terminals) + 1
+
+        productions = [self._encode(lhs, rhs, nt_index)
+                       for lhs, rhs in self.PRODUCTIONS]
+        table = array.array("i", [ParseTable.ERROR]) * \
+                    (len(nonterminals) * width)
+        clashes = collections.defaultdict(list)
+        for number, predict in enumerate(self.PREDICT):
+            self._fill(table, productions[number][0] * width, number,
+                       predict, clashes)
+
+        conflicts = self._conflicts(table, width, clashes)
+        self.TABLE = ParseTable(nonterminals, terminals, productions, table,
+                                conflicts)
+        return self.TABLE
+
+    def _encode(self, lhs, rhs, nt_index):
+        """
+        Production in ParseTable form
+        """
+        return (nt_index[lhs], tuple(
+            -(nt_index[sym] + 1) if sym in nt_index else
+            self.TERMINAL_ID[sym] - 1 for sym in rhs))
+
+    def _fill(self, table, row, number, predict, clashes):
+        """
+        Enter production number into the row for every predicted terminal
+        """
+        predict >>= 1
+        column = 0
+        while predict:
+            if predict & 1:
+                entry = row + column
+                if table[entry] == ParseTable.ERROR:
+                    table[entry] = number
+                else:
+                    clashes[entry].append(number)
+            predict >>= 1
+            column += 1
+
+    def _conflicts(self, table, width, clashes):
+        """
+        Conflict list from the clashes collected by _fill
+        """
+        return [(entry // width, entry % width, [table[entry]] + numbers)
+                for entry, numbers in sorted(clashes.iteritems())]
+
+    @stats.timed("update")
+    def update(self, ir, start = None):
+        """
+        Bring an initialized generator up to date with a new IR.
+        Only the nonterminals whose productions changed and whatever
+        their first and follow sets reach are recomputed, the table rows
+        of the rest are kept and renumbered. When the symbols or the
+        start symbol change, the terminal numbering and table shape do
+        too and everything is rebuilt.
+        @param:
+        ir - {lhs: [rhs symbols]}
+        start - start symbol, defaults to the current one
+        @return:
+        set of nonterminals whose table rows were rebuilt
+        """
+        old_ir = self.IR
+        self.IR = collections.defaultdict(list)
+        for p in ir:
+            self.IR[p] = [tuple(e) for e in ir[p]] #the caller may edit ir
+        start = start if start is not None else self.START
+        nt = set(self.IR)
+        sym = set(s for p in self.IR for e in self.IR[p] for s in e)
+        if (nt != self.NT or sym.difference(nt) != self.T or
+                start != self.START or self.TABLE is None):
+            self.NT, self.SYM, self.T = nt, sym, sym.difference(nt)
+            self.START = start
+            self.first_set()
+            self.follow_set()
+            self.predict_set()
+            self.build_table()
+            return nt
+        changed = set(p for p in nt
+                      if map(tuple, old_ir.get(p, ())) != self.IR[p])
+        if not changed:
+            return changed
+        self.SYM = sym
+
+        dependents = self._dependents()
+        affected = set()
+        stack = list(changed)
+        while stack:
+            p = stack.pop()
+            if p not in affected:
+                affected.add(p)
+                stack.extend(dependents[p])
+        old_first = dict((p, self.FIRST_BITS[p]) for p in affected)
+        for p in affected:
+            self.FIRST_BITS[p] = 0
+        self._first_fixpoint(affected, dependents)
+        first_changed = set(p for p in affected
+                            if old_first[p] != self.FIRST_BITS[p])
+
+        seeds = set()
+        for p in changed:
+            for expansion in list(old_ir.get(p, [])) + self.IR[p]:
+                seeds.update(s for s in expansion if s in nt)
+        for x in first_changed:
+            for p in dependents[x]:
+                for expansion in self.IR[p]:
+                    seeds.update(s for s in expansion if s in nt)
+        follow_changed = self._follow_update(seeds, dependents)
+
+        rows = changed | follow_changed
+        for x in first_changed:
+            rows.update(dependents[x])
+        self._patch_table(rows)
+        return rows
+
+    def _flows(self, p):
+        """
+        Nonterminals FOLLOW(p) flows into, see follow_set
+        """
+        flows = set()
+        for expansion in self.IR[p]:
+            for symbol in reversed(expansion):
+                if symbol in self.NT and symbol != p:
+                    flows.add(symbol)
+                if not self.FIRST_BITS[symbol] & EPSILON_BIT:
+                    break
+        return flows
+
+    def _follow_update(self, seeds, dependents):
+        """
+        Recompute the follow sets of seeds and every nonterminal their
+        follow sets flow into, the rest of FOLLOW_BITS is final
+        @return:
+        set of nonterminals whose follow set changed
+        """
+        first_bits = self.FIRST_BITS
+        follow_bits = self.FOLLOW_BITS
+        flows = {}
+        affected = set()
+        stack = list(seeds)
+        while stack:
+            b = stack.pop()
+            if b not in affected:
+                affected.add(b)
+                flows[b] = self._flows(b)
+                stack.extend(flows[b])
+
+        old_follow = dict((b, follow_bits[b]) for b in affected)
+        eof = 1 << self.TERMINAL_ID[self.TOKENS.EOF]
+        for b in affected:
+            follow_bits[b] = eof if b == self.START else 0
+        for b in affected:
+            for p in dependents[b]:
+                for expansion in self.IR[p]:
+                    trailer = 0
+                    nullable = True
+                    for symbol in reversed(expansion):
+                        first = first_bits[symbol]
+                        if symbol == b:
+                            follow_bits[b] |= trailer
+                            if nullable and p not in affected:
+                                follow_bits[b] |= follow_bits[p]
+                        if (first & EPSILON_BIT):
+                            trailer |= first & ~EPSILON_BIT
                         else:
-                            trailer = self.FIRST[symbol]
+                            trailer = first
+                            nullable = False
+
+        worklist = collections.deque(affected)
+        queued = set(worklist)
+        iterations = 0
+        while worklist:
+            p = worklist.popleft()
+            queued.discard(p)
+            iterations += 1
+            for symbol in flows[p]:
+                follow = follow_bits[symbol] | follow_bits[p]
+                if follow != follow_bits[symbol]:
+                    follow_bits[symbol] = follow
+                    if symbol not in queued:
+                        queued.add(symbol)
+                        worklist.append(symbol)
+        _count("follow_iterations", iterations)
+        return set(b for b in affected if old_follow[b] != follow_bits[b])
+
+    def _patch_table(self, rows):
+        """
+        Recompute predict sets and table rows of the given nonterminals,
+        shift production numbers in the other rows
+        """
+        old_table = self.TABLE
+        old_start = {}
+        for number, (lhs, _) in enumerate(self.PRODUCTIONS):
+            old_start.setdefault(lhs, number)
+        old_productions = self.PRODUCTIONS
+        old_predict = self.PREDICT
+        width = old_table.width
+        nonterminals = self.nonterminals()
+        nt_index = dict((nt, i) for i, nt in enumerate(nonterminals))
 
+        self.PRODUCTIONS = []
+        self.PREDICT = []
+        productions = []
+        table = old_table.table
+        clashes = collections.defaultdict(list)
+        conflicts = []
+        old_conflicts = collections.defaultdict(list)
+        for conflict in old_table.conflicts:
+            old_conflicts[conflict[0]].append(conflict)
+        for index, lhs in enumerate(nonterminals):
+            first = len(self.PRODUCTIONS)
+            row = index * width
+            if lhs in rows:
+                table[row:row + width] = \
+                    array.array("i", [ParseTable.ERROR]) * width
+                for expansion in self.IR[lhs]:
+                    predict = self.first_bits(expansion)
+                    if predict & EPSILON_BIT:
+                        predict = (predict & ~EPSILON_BIT) | \
+                                    self.FOLLOW_BITS[lhs]
+                    number = len(self.PRODUCTIONS)
+                    self.PRODUCTIONS.append((lhs, tuple(expansion)))
+                    self.PREDICT.append(predict)
+                    productions.append(self._encode(lhs, expansion,
+                                                    nt_index))
+                    self._fill(table, row, number, predict, clashes)
+                continue
+            count = len(self.IR[lhs])
+            old = old_start[lhs]
+            self.PRODUCTIONS.extend(old_productions[old:old + count])
+            self.PREDICT.extend(old_predict[old:old + count])
+            productions.extend(old_table.productions[old:old + count])
+            shift = first - old
+            if shift:
+                error = ParseTable.ERROR
+                table[row:row + width] = array.array("i", [
+                    e if e == error else e + shift
+                    for e in table[row:row + width]])
+            for nonterminal, column, numbers in old_conflicts[index]:
+                conflicts.append((nonterminal, column,
+                                  [n + shift for n in numbers]))
+        conflicts.extend(self._conflicts(table, width, clashes))
+        conflicts.sort()
+        self.TABLE = ParseTable(nonterminals, old_table.terminals,
+                                productions, table, conflicts)
+
+    def state(self):
+        """
+        Everything initialize computed as plain values, for caching
+        """
+        table = StringIO.StringIO()
+        self.TABLE.dump(table)
+        return {"ir": dict(self.IR), "nt": self.NT, "t": self.T,
+                "start": self.START, "terminals": self.TERMINALS,
+                "first": self.FIRST_BITS, "follow": self.FOLLOW_BITS,
+                "predict": self.PREDICT, "table": table.getvalue()}
+
+    @classmethod
+    def from_state(cls, state):
+        """
+        Rebuild an initialized generator from state(), without a parse
+        tree
+        """
+        generator = cls(None)
+        generator.IR.update(state["ir"])
+        generator.NT = state["nt"]
+        generator.T = state["t"]
+        generator.SYM = set(s for p in generator.IR
+                            for e in generator.IR[p] for s in e)
+        generator.START = state["start"]
+        generator.TERMINALS = state["terminals"]
+        generator.TERMINAL_ID = dict((t, i) for i, t in
+                                     enumerate(generator.TERMINALS))
+        generator.FIRST_BITS = state["first"]
+        generator.FOLLOW_BITS = state["follow"]
+        generator.FIRST = utils.BitSets(generator.FIRST_BITS,
+                                        generator.TERMINALS)
+        generator.FOLLOW = utils.BitSets(generator.FOLLOW_BITS,
+                                         generator.TERMINALS)
+        generator.PRODUCTIONS = [(lhs, tuple(e))
+                                 for lhs in generator.nonterminals()
+                                 for e in generator.IR[lhs]]
+        generator.PREDICT = state["predict"]
+        generator.TABLE = ParseTable.loads(state["table"])
+        return generator
+
+    def _dependents(self):
+        """
+        Map every symbol to the nonterminals whose right hand sides use it
+        """
+        dependents = collections.defaultdict(set)
+        for p in self.IR:
+            for expansion in self.IR[p]:
+                for symbol in expansion:
+                    dependents[symbol].add(p)
+        return dependents
 
     def dfs(self, node):
         """
-        Dfs algorithm to explore parse tree.
-        Determine terminal & non-terminal symbols
+        Walk the parse tree and collect the productions into IR.
+        Preorder walk with an explicit stack, right recursive symbol lists
+        make the tree as deep as the longest right hand side. A symbol
+        below a production set is a left hand side, any other symbol
+        belongs to the right hand side being read, which is complete when
+        the walk reaches the ProductionSet' node after it.
         @param:
-        node
-        visited
+        node - root of the parse tree
+        """
+        symbol = self.TOKENS.SYMBOL
+        production_set = self._state.PRODUCTIONSET
+        production_set_p = self._state.PRODUCTIONSET_P
+        lhs = ""
+        rhs = []
+        stack = [(node, self._state.GRAMMAR)]
+        while stack:
+            node, parent = stack.pop()
+            node_type = node.type
+            if (node_type == symbol):
+                if (parent == production_set):
+                    lhs = node.data
+                    self.NT.add(lhs)
+                    if self.START is None:
+                        self.START = lhs
+                else:
+                    self.SYM.add(node.data)
+                    rhs.append(node.data)
+            elif (node_type == production_set_p):
+                self.IR[lhs].append(tuple(rhs))
+                rhs = []
+            if node.children:
+                stack.extend((child, node_type)
+                             for child in reversed(node.children))
+
+
+class ParseTable(object):
+    """
+    A dense LL(1) parse table.
+
+    nonterminals - names, nonterminals[0] is the start symbol
+    terminals - names, terminals[i] labels column i + 1, column 0 is EOF
+    productions - list of (lhs, rhs), lhs is a nonterminal index and rhs
+                  a tuple of symbol codes: a column for terminals and
+                  -(index + 1) for nonterminals
+    table - array('i'), table[nonterminal * width + column] holds the
+            production to expand or ERROR
+    conflicts - list of (nonterminal, column, [productions]) for entries
+                predicted by several productions, the first one is used
+    """
+    ERROR = -1
+    EOF_COLUMN = 0
+    MAGIC = "LL1T"
+    VERSION = 2
+    #magic, version, byte order, nonterminals, terminals, productions,
+    #rhs symbols, conflict ints, bytes of names
+    HEADER = struct.Struct("<4sIcIIIIII")
+
+    def __init__(self, nonterminals, terminals, productions, table,
+                    conflicts = None):
+        self.nonterminals = nonterminals
+        self.terminals = terminals
+        self.productions = productions
+        self.table = table
+        self.conflicts = conflicts or []
+        self.width = len(terminals) + 1
+        self.column = dict((t, i) for i, t in enumerate(terminals, 1))
+
+    def lookup(self, nonterminal, column):
+        """
+        Production to expand for nonterminal index on a column, or ERROR
+        """
+        return self.table[nonterminal * self.width + column]
+
+    def report_conflicts(self):
+        """
+        Describe every conflict
         @return:
-        non-termianls - set of non-terminals
-        terminals - set of terminal symbols
-        ir - intermediate reprsentation 
+        list of strings
         """
-        #FIXME: this is a hack
-        try:
-            sl.info("parent state: " + self._state.get_key_for_value(self.PARENT_STATE))
-        except IndexError:
-            sl.info("parent state: " + self.TOKENS.get_key_for_value(self.PARENT_STATE))
+        names = ["EOF"] + [str(t) for t in self.terminals]
+        report = []
+        for nonterminal, column, numbers in self.conflicts:
+            report.append("conflict: {0} on {1}: {2}".format(
+                self.nonterminals[nonterminal], names[column],
+                " | ".join(self.format_production(n) for n in numbers)))
+        return report
+
+    def format_production(self, number):
+        """
+        Production as text, e.g. "Expr -> Term EPrime"
+        """
+        lhs, rhs = self.productions[number]
+        symbols = [self.nonterminals[-code - 1] if code < 0 else
+                   str(self.terminals[code - 1]) for code in rhs]
+        return self.nonterminals[lhs] + " -> " + \
+                (" ".join(symbols) or "epsilon")
+
+    def dump(self, fh):
+        """
+        Write the table in binary form: a header, the table, production
+        left hand sides, offsets and symbols and the conflicts as int32
+        arrays, then the names separated by NUL bytes. A conflict is
+        stored as nonterminal, column, number of productions, productions.
+        """
+        lhs = array.array("i", [l for l, _ in self.productions])
+        offsets = array.array("i", [0])
+        rhs = array.array("i")
+        for _, symbols in self.productions:
+            rhs.extend(symbols)
+            offsets.append(len(rhs))
+        conflicts = array.array("i")
+        for nonterminal, column, numbers in self.conflicts:
+            conflicts.extend([nonterminal, column, len(numbers)])
+            conflicts.extend(numbers)
+        names = "\0".join(list(self.nonterminals) +
+                          [str(t) for t in self.terminals])
+        byteorder = "<" if sys.byteorder == "little" else ">"
+        fh.write(self.HEADER.pack(self.MAGIC, self.VERSION, byteorder,
+                    len(self.nonterminals), len(self.terminals),
+                    len(self.productions), len(rhs), len(conflicts),
+                    len(names)))
+        for part in (self.table, lhs, offsets, rhs, conflicts):
+            fh.write(part.tostring())
+        fh.write(names)
+
+    @classmethod
+    def load(cls, fh):
+        """
+        Read a table written by dump with a single read
+        """
+        return cls.loads(fh.read())
+
+    @classmethod
+    def loads(cls, data):
+        """
+        Build a table from the bytes written by dump, data may be a
+        string or an mmap
+        """
+        (magic, version, byteorder, num_nt, num_t, num_prod, num_rhs,
+            num_conflict, names_size) = cls.HEADER.unpack_from(data, 0)
+        if magic != cls.MAGIC or version != cls.VERSION:
+            raise ValueError("not a version {0} parse table".format(
+                                cls.VERSION))
+        swap = byteorder != ("<" if sys.byteorder == "little" else ">")
+        pos = [cls.HEADER.size]
+        def take(count):
+            part = array.array("i")
+            start = pos[0]
+            pos[0] += count * part.itemsize
+            part.fromstring(data[start:pos[0]])
+            if swap:
+                part.byteswap()
+            return part
+        table = take(num_nt * (num_t + 1))
+        lhs = take(num_prod)
+        offsets = take(num_prod + 1)
+        rhs = take(num_rhs)
+        flat = take(num_conflict)
+        names = data[pos[0]:pos[0] + names_size].split("\0")
+
+        productions = [(lhs[i], tuple(rhs[offsets[i]:offsets[i + 1]]))
+                       for i in xrange(num_prod)]
+        conflicts = []
+        i = 0
+        while i < len(flat):
+            end = i + 3 + flat[i + 2]
+            conflicts.append((flat[i], flat[i + 1], flat[i + 3:end].tolist()))
+            i = end
+        return cls(names[:num_nt], names[num_nt:], productions, table,
+                   conflicts)
+
+    def as_dict(self):
+        """
+        The table as plain lists, for json and python output
+        """
+        return {"nonterminals": list(self.nonterminals),
+                "terminals": [str(t) for t in self.terminals],
+                "productions": [[lhs, list(rhs)]
+                                for lhs, rhs in self.productions],
+                "table": self.table.tolist(),
+                "conflicts": [[nonterminal, column, list(numbers)]
+                              for nonterminal, column, numbers
+                              in self.conflicts]}
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Inverse of as_dict
+        """
+        return cls([str(n) for n in data["nonterminals"]],
+                   [str(t) for t in data["terminals"]],
+                   [(lhs, tuple(rhs)) for lhs, rhs in data["productions"]],
+                   array.array("i", data["table"]),
+                   [(nonterminal, column, numbers) for nonterminal, column,
+                    numbers in data.get("conflicts", [])])
+
+
+def _format_binary(tables):
+    """
+    ParseTable.dump of the table, main allows a single grammar only
+    """
+    return "".join(data for _, data in tables)
+
+
+def _format_json(tables):
+    """
+    One json object per line and table, ParseTable.as_dict plus the
+    grammar it was built from
+    """
+    import json
+    lines = []
+    for name, data in tables:
+        table = ParseTable.loads(data).as_dict()
+        table["grammar"] = name
+        lines.append(json.dumps(table, sort_keys = True,
+                                separators = (",", ":")) + "\n")
+    return "".join(lines)
+
+
+def _format_python(tables):
+    """
+    Python module with a TABLES dict from grammar to ParseTable.as_dict,
+    load a table with ParseTable.from_dict(TABLES[grammar])
+    """
+    out = ['"""\nLL(1) parse tables generated by parser_generator\n'
+           '"""\n\nTABLES = {}\n']
+    for name, data in tables:
+        out.append("TABLES[{0!r}] = {1!r}\n".format(name,
+                                            ParseTable.loads(data).as_dict()))
+    return "".join(out)
+
+
+FORMATS = {"binary": _format_binary,
+           "json": _format_json,
+           "python": _format_python}
+
+
+def format_tables(tables, output_format = "binary"):
+    """
+    Render tables in one of FORMATS
+    @param:
+    tables - list of (grammar name, ParseTable.dump output)
+    @return:
+    string, written out with a single call by main
+    """
+    return FORMATS[output_format](tables)
+
+
+def bnf_terminals(tokens):
+    """
+    Terminal names used by bnf.txt for the scanner token types
+    @param:
+    tokens - CompilerBase.TOKENS
+    """
+    return {tokens.SEMICOLON: "SEMICOLON", tokens.DERIVES: "DERIVES",
+            tokens.ALSODERIVES: "ALSODERIVES", tokens.EPSILON: "EMPTY",
+            tokens.SYMBOL: "SYMBOL"}
+
+
+def bnf_table():
+    """
+    LL(1) table of the bnf meta grammar, generated from bnf.txt with the
+    recursive descent parser once per process
+    """
+    global _BNF_TABLE
+    if _BNF_TABLE is None:
+        s = compiler.Scanner(BNF_GRAMMAR)
+        parser = compiler.Parser(s.iter_tokens(), s.bnf_file,
+                                 build_tree = False)
+        generator = TableGenerator.from_ir(parser.execute()[1], parser.START)
+        generator.initialize()
+        assert not generator.TABLE.conflicts
+        _BNF_TABLE = generator.TABLE
+    return _BNF_TABLE
+
+
+def parse_grammar(filename):
+    """
+    Parse a bnf grammar file with the table driven parser
+    @return:
+    tuple object (True, derivation), see compiler.LL1Parser.execute
+    """
+    s = compiler.Scanner(filename, stream = True)
+    parser = compiler.LL1Parser(bnf_table(), s.iter_tokens(),
+                                bnf_terminals(s.TOKENS))
+    return parser.execute()
+
+
+def generate(filename, table_cache = None):
+    """
+    Build the LL(1) tables of a grammar file. With a cache, scanning,
+    parsing and table generation are skipped for grammar text this
+    generator version has seen before.
+    @param:
+    filename - bnf grammar
+    table_cache - cache.TableCache, None to always generate
+    @return:
+    initialized TableGenerator without a parse tree
+    """
+    key = None
+    if table_cache is not None:
+        with open(filename, "rb") as fh:
+            key = table_cache.key("grammar", str(ParseTable.VERSION),
+                                  fh.read())
+        state = table_cache.get(key)
+        if state is not None:
+            return TableGenerator.from_state(state)
+    s = compiler.Scanner(filename)
+    parser = compiler.Parser(s.iter_tokens(), s.bnf_file, build_tree = False)
+    generator = TableGenerator.from_ir(parser.execute()[1], parser.START)
+    generator.initialize()
+    if key is not None:
+        table_cache.put(key, generator.state())
+    return generator
+
+
+def _production_sets(tokens, types):
+    """
+    Split a token list into production sets, each ending with its
+    semicolon. A trailing incomplete set is kept so parsing reports it.
+    @param:
+    types - CompilerBase.TOKENS
+    """
+    semicolon = types.SEMICOLON
+    sets = []
+    current = []
+    for token in tokens:
+        current.append(token)
+        if token.type == semicolon:
+            sets.append(current)
+            current = []
+    if current:
+        sets.append(current)
+    return sets
+
+
+def _common_affixes(old, new):
+    """
+    Length of the common prefix and suffix of two strings, the suffix
+    never overlaps the prefix. Binary search, so comparisons run in C.
+    """
+    def common(length, same):
+        lo, hi = 0, length
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if same(mid):
+                lo = mid
+            else:
+                hi = mid - 1
+        return lo
+    limit = min(len(old), len(new))
+    prefix = common(limit, lambda n: old[:n] == new[:n])
+    suffix = common(limit - prefix,
+                    lambda n: old[len(old) - n:] == new[len(new) - n:])
+    return prefix, suffix
+
+
+def _production_set_ir(tokens, types):
+    """
+    Check a production set against the bnf grammar and read its
+    productions off the tokens
+    @return:
+    tuple object (lhs, [[rhs symbols]])
+    """
+    eof = compiler.Token("", types.EOF, tokens[-1].lino,
+                         tokens[-1].offset + len(tokens[-1].value))
+    compiler.LL1Parser(bnf_table(), tokens + [eof],
+                       bnf_terminals(types)).execute()
+    expansions = [[]]
+    for token in tokens[2:-1]:
+        if token.type == types.ALSODERIVES:
+            expansions.append([])
+        elif token.type == types.SYMBOL:
+            expansions[-1].append(intern(token.value))
+    return intern(tokens[0].value), [tuple(e) for e in expansions]
+
+
+def build(filename, text = None):
+    """
+    Tables for a grammar file without a parse tree. Production sets are
+    checked by the table driven parser and read off the tokens, so deep
+    grammars don't hit the recursion limit and syntax errors raise
+    compiler.ParseError.
+    @param:
+    filename - bnf grammar
+    text - grammar text, if given filename only names it in messages
+    @return:
+    initialized TableGenerator
+    """
+    s = compiler.Scanner(filename, text = text)
+    tokens = s.scan_range(0, s.file_length)
+    ir = collections.defaultdict(list)
+    start = None
+    for production_set in _production_sets(tokens, s.TOKENS):
+        lhs, expansions = _production_set_ir(production_set, s.TOKENS)
+        ir[lhs].extend(expansions)
+        if start is None:
+            start = lhs
+    if start is None:
+        raise compiler.ParseError("{0}: no productions".format(filename))
+    generator = TableGenerator(None)
+    generator.update(ir, start)
+    return generator
+
+
+def regenerate(filename, table_cache):
+    """
+    Incremental generate for a grammar file that is being edited.
+    The cache remembers the last version of every path: its text, the
+    byte range and productions of each production set, and the generator
+    state. Production sets inside the unchanged prefix and suffix of the
+    text are reused, only the bytes between them are scanned and parsed
+    again, and TableGenerator.update recomputes what the changed
+    productions reach.
+    @param:
+    filename - bnf grammar
+    table_cache - cache.TableCache
+    @return:
+    initialized TableGenerator without a parse tree
+    """
+    key = table_cache.key("last", str(ParseTable.VERSION),
+                          os.path.abspath(filename))
+    last = table_cache.get(key)
+    s = compiler.Scanner(filename)
+    text = s.bnf_file
+    if last is None:
+        old_text, old_sets = "", []
+        generator = TableGenerator(None)
+    else:
+        old_text, old_sets = last["text"], last["sets"]
+        last["state"]["ir"] = _sets_ir(old_sets)
+        generator = TableGenerator.from_state(last["state"])
+
+    prefix, suffix = _common_affixes(old_text, text)
+    delta = len(text) - len(old_text)
+    head = []
+    tail = []
+    for start, end, fragment in old_sets:
+        if end <= prefix:
+            head.append((start, end, fragment))
+        elif start > len(old_text) - suffix:
+            #the separator before the set is unchanged too
+            tail.append((start + delta, end + delta, fragment))
+    begin = head[-1][1] if head else 0
+    finish = tail[0][0] if tail else len(text)
+    tokens = s.scan_range(begin, finish, text.count("\n", 0, begin) + 1)
+    middle = []
+    for production_set in _production_sets(tokens, s.TOKENS):
+        last_token = production_set[-1]
+        middle.append((production_set[0].offset,
+                       last_token.offset + len(last_token.value),
+                       _production_set_ir(production_set, s.TOKENS)))
+
+    sets = head + middle + tail
+    start = sets[0][2][0] if sets else None
+    generator.update(_sets_ir(sets), start)
+
+    state = generator.state()
+    del state["ir"] #the sets hold it
+    table_cache.put(key, {"text": text, "sets": sets, "state": state})
+    return generator
+
+
+def _sets_ir(sets):
+    """
+    IR of a list of (start, end, (lhs, expansions)) production sets
+    """
+    ir = collections.defaultdict(list)
+    for _, _, (lhs, expansions) in sets:
+        ir[lhs].extend(expansions)
+    return ir
+
+
+def _build_results(paths, jobs):
+    """
+    batch.BuildResult for every grammar, None in paths reads stdin
+    """
+    import batch #imports this module
+    if paths is None:
+        return [batch.build_one("<stdin>", sys.stdin.read())]
+    return batch.build_all(paths, jobs)
+
+
+def main(argv = None):
+    """
+    Build the tables of every grammar and write them in one piece.
+    Errors and conflicts go to stderr.
+    @return:
+    exit status, 1 if any grammar failed
+    """
+    args = p.parse_args(sys.argv[1:] if argv is None else argv)
+    simplelog.sl.disable()
+    paths = None
+    if args.grammars != ["-"]:
+        if "-" in args.grammars:
+            p.error("stdin can't be mixed with grammar files")
+        import batch
         try:
-            sl.info("current state: " + self._state.get_key_for_value(node.type))
-        except IndexError:
-            sl.info("current state: " + self.TOKENS.get_key_for_value(node.type))
-        #check if node has been explored
-        if node in self.VISITED:
-            return
-        self.VISITED.add(node)
-
-        if (self.PARENT_STATE == self._state.PRODUCTIONSET):
-            if (node.type == self.TOKENS.SYMBOL):
-                sl.info("found lhs: " + node.data)
-                self.LHS = node.data
-                self.NT.add(node.data)
-        else:
-            #PS -> SYM : RH
-            if (node.type == self.TOKENS.SYMBOL):
-                sl.info("found rhs: " + node.data)
-                self.SYM.add(node.data)
-                self.RHS.append(node.data)
-        if(node.type == self._state.PRODUCTIONSET_P):
-            sl.info("added new rhs: " + str(self.RHS))
-            self.IR[self.LHS].append(self.RHS) 
-            self.RHS = []
-
-        for h in node.children:
-            self.PARENT_STATE = node.type #maybe better to use stack
-            self.dfs(h)
-
-
-def main():
-    args = p.parse_args(sys.argv[1:])
+            paths = batch.expand(args.grammars)
+        except ValueError as err:
+            p.error(str(err))
+        if args.format == "binary" and len(paths) > 1:
+            p.error("the binary format holds a single grammar, use json, "
+                    "python or batch.py for several")
+    if (args.stats or args.profile) and args.jobs > 1:
+        p.error("--stats and --profile only measure this process, "
+                "use --jobs 1")
+    if args.stats or args.profile:
+        with stats.collect(args.profile) as collected:
+            results = _build_results(paths, args.jobs)
+        sys.stderr.write(collected.report() + "\n" +
+                         collected.profile_report())
+    else:
+        results = _build_results(paths, args.jobs)
+
+    report = []
+    for result in results:
+        if result.error is not None:
+            report.append("{0}: {1}\n".format(result.path, result.error))
+        for conflict in result.conflicts:
+            report.append("{0}: {1}\n".format(result.path, conflict))
+    sys.stderr.write("".join(report))
+
+    data = format_tables([(result.path, result.table) for result in results
+                          if result.table is not None], args.format)
+    if args.output == "-":
+        sys.stdout.write(data)
+        sys.stdout.flush()
+    else:
+        with open(args.output, "wb") as fh:
+            fh.write(data)
+    return 1 if any(result.error is not None for result in results) else 0
 
 
 if __name__ == "__main__":
-    sl = simplelog.sl
-    sl.disable()
-    #DEBUG = True
-    s = compiler.Scanner("test/RRSheepNoise.txt")
-    r = s.execute()
-    p = compiler.Parser(r, s.bnf_file)
-    r_p = p.execute()
-    sl.enable()
-    sl.info("========")
-    sl.info("========")
-    t = TableGenerator(r_p[1])
-    r_t = t.initialize()
+    sys.exit(main())
 
 
@@ -1,23 +1,32 @@
+import automata
+import batch
+import benchmark
+import cache
+import codegen
 import compiler
+import copy
+import json
+import os
+import pickle
+import pstats
+import shutil
+import StringIO
+import sys
+import tempfile
 import unittest
 
 import simplelog
-from pylibs.data_structures import graph
+import stats
+import table_generator
+import utils
+from pylibs.data_structures import tree
 
 
 
 class TestScanner(unittest.TestCase):
     def setUp(self):
-        self.DFA_REG = graph.Graph()
-        self.DFA_REG.add_node(0, "NT")
-        self.DFA_REG.add_node(1, "NT")
-        self.DFA_REG.add_node(2, "T")
-        self.DFA_REG.add_edge(0, 1, "r")
-        self.DFA_REG.add_edge(1, 2, "0123456789")
-        self.DFA_REG.add_edge(2, 2, "0123456789")
-
         self.compiler = compiler.Scanner("test/reg.txt") #FIXME: use a better test case
-        self.compiler.DFA.append(("register", self.DFA_REG))
+        self.compiler.SPEC.insert(0, ("register", "r[0-9]+"))
         self.compiler._initialize_dfa()
     
     @unittest.skip("skip")
@@ -30,57 +39,82 @@ class TestScanner(unittest.TestCase):
                             set([0,1,2]))
         self.assertTrue(r == [expected_results])
 
-    def test_gen_table(self):
-        """ 
-        Generate the register scanner tables
-        """
-        r = self.compiler._gen_tables("register", self.DFA_REG)
-        expected_results = ({'1': 1, '0': 1, '3': 1, '2': 1, '5': 1,
-                            '4': 1, '7': 1, '6': 1, '9': 1, '8': 1, 'r': 0}, 
-                            {0: {0: 1}, 1: {1: 2, 2: 2}}, 
-                            {2: "register"},
-                            set([0,1,2]))
-        self.assertTrue(r == expected_results)
-   
-    @unittest.skip("order matters during checking")
     def test_next_word(self):
         r = self.compiler.next_word()
         expected_word = ("r10", "register")
-        print(r)
         self.assertTrue(r == expected_word)
 
     def test_scanner(self):
         self.compiler._get_input("test/RRSheepNoise.txt")
         r = self.compiler.execute()
-        expected = [{'lino': 1, 'type': 4, 'value': 'Goal'}, 
-                    {'lino': 1, 'type': 1, 'value': ':'}, 
-                    {'lino': 1, 'type': 4, 'value': 'SheepNoise'}, 
-                    {'lino': 2, 'type': 0, 'value': ';'}, 
-                    {'lino': 3, 'type': 4, 'value': 'SheepNoise'}, 
-                    {'lino': 3, 'type': 1, 'value': ':'}, 
-                    {'lino': 3, 'type': 4, 'value': 'baa'}, 
-                    {'lino': 3, 'type': 4, 'value': 'SheepNoise'}, 
-                    {'lino': 4, 'type': 2, 'value': '|'}, 
-                    {'lino': 4, 'type': 4, 'value': 'baa'}, 
-                    {'lino': 5, 'type': 0, 'value': ';'}, 
-                    {'lino': 6, 'type': 5, 'value': ''}]
+        Token = compiler.Token
+        expected = [Token('Goal', 4, 1, 0), 
+                    Token(':', 1, 1, 11), 
+                    Token('SheepNoise', 4, 1, 13), 
+                    Token(';', 0, 2, 36), 
+                    Token('SheepNoise', 4, 3, 38), 
+                    Token(':', 1, 3, 49), 
+                    Token('baa', 4, 3, 51), 
+                    Token('SheepNoise', 4, 3, 55), 
+                    Token('|', 2, 4, 77), 
+                    Token('baa', 4, 4, 79), 
+                    Token(';', 0, 5, 94), 
+                    Token('', 5, 6, 96)]
         self.assertTrue(r == expected)
 
+    def test_iter_tokens_stream(self):
+        """
+        Chunked scanning matches scanning the whole file
+        """
+        expected = compiler.Scanner("test/RRCEG.txt").execute()
+        for chunk_size in (1, 3, 7, 4096):
+            s = compiler.Scanner("test/RRCEG.txt", stream = True)
+            r = list(s.iter_tokens(chunk_size))
+            self.assertEqual(r, expected)
+
+    def test_mmap(self):
+        expected = compiler.Scanner("test/RRCEG.txt").execute()
+        s = compiler.Scanner("test/RRCEG.txt", use_mmap = True)
+        self.assertEqual(s.execute(), expected)
+        s.close()
+        self.assertRaises(ValueError, compiler.Scanner, "test/RRCEG.txt",
+                          stream = True, use_mmap = True)
+
+    def test_shared_state(self):
+        """
+        Enums and scanner tables are built once and shared
+        """
+        a = compiler.Scanner("test/RRCEG.txt")
+        b = compiler.Scanner("test/P1.txt")
+        parser = compiler.Parser([], None)
+        self.assertTrue(a.TOKENS is b.TOKENS is parser.TOKENS)
+        self.assertTrue(a._state is parser._state)
+        self.assertTrue(a.DFA_TABLE is b.DFA_TABLE)
+        self.assertRaises(TypeError, a.TOKENS.__setitem__, "NEW", 9)
+
+    def test_scan_range(self):
+        s = compiler.Scanner("test/RRCEG.txt")
+        tokens = list(s.iter_tokens())
+        start = s.bnf_file.index("EPrime :")
+        end = s.bnf_file.index("Term   :")
+        r = s.scan_range(start, end, 7)
+        self.assertEqual(r, [t for t in tokens if start <= t.offset < end])
+
     def test_semicolon(self):
         self.compiler._get_input("test/semicolon.txt")
         self.compiler._initialize_dfa()
         sl.info(self.compiler.DFA_TABLE)
         r = self.compiler.execute()
-        self.assertTrue(r == [{'lino': 1, 'type': 0, 'value': ';'}, 
-                                {'lino': 2, 'type': 5, 'value': ''}])
+        self.assertTrue(r == [compiler.Token(';', 0, 1, 0), 
+                                compiler.Token('', 5, 2, 2)])
 
     def test_also_derives(self):
         self.compiler._get_input("test/derives.txt")
         self.compiler._initialize_dfa()
         sl.info(self.compiler.DFA_TABLE)
         r = self.compiler.execute()
-        self.assertTrue(r == [{'lino': 1, 'type': 2, 'value': '|'}, 
-                                {'lino': 2, 'type': 5, 'value': ''}])
+        self.assertTrue(r == [compiler.Token('|', 2, 1, 0), 
+                                compiler.Token('', 5, 2, 2)])
 
     def test_symbol(self):
         self.compiler._get_input("test/symbol.txt")
@@ -88,12 +122,125 @@ class TestScanner(unittest.TestCase):
         sl.info(self.compiler.DFA_TABLE)
         r = self.compiler.execute()
         sl.info(r)
-        self.assertTrue(r == [{'lino': 1, 'type': 4, 'value': 'foo'}, 
-                                {'lino': 2, 'type': 5, 'value': ''}])
+        self.assertTrue(r == [compiler.Token('foo', 4, 1, 0), 
+                                compiler.Token('', 5, 2, 4)])
 
     def tearDown(self):
         return
 
+class TestEnum(unittest.TestCase):
+    def test_members(self):
+        e = utils.Enum("A", "B", "keys", start = 6)
+        self.assertEqual(e.A, 6)
+        self.assertEqual(e["B"], 7)
+        self.assertEqual(e.get_key_for_value(8), "keys")
+        self.assertTrue(callable(e.keys))
+        self.assertEqual(e.C, None)
+        self.assertRaises(IndexError, e.get_key_for_value, 9)
+        e["C"] = 9
+        self.assertEqual((e.C, e.get_key_for_value(9)), (9, "C"))
+
+    def test_mutators(self):
+        e = utils.Enum("A", "B", "C")
+        e.update(D = 3)
+        self.assertEqual((e.D, e.get_key_for_value(3)), (3, "D"))
+        self.assertEqual(e.pop("D"), 3)
+        self.assertEqual(e.D, None)
+        self.assertRaises(IndexError, e.get_key_for_value, 3)
+        self.assertEqual(e.setdefault("A", 9), 0)
+        del e["C"]
+        self.assertEqual((e.C, sorted(e)), (None, ["A", "B"]))
+        key, value = e.popitem()
+        self.assertEqual(getattr(e, key), None)
+        e.clear()
+        self.assertEqual((dict(e), e.A, e.B), ({}, None, None))
+
+    def test_frozen(self):
+        e = utils.Enum("A", "B").freeze()
+        for change in (lambda: e.__setitem__("C", 2),
+                       lambda: e.__delitem__("A"),
+                       lambda: e.update(C = 2),
+                       lambda: e.pop("A"),
+                       lambda: e.pop("C", None),
+                       lambda: e.popitem(),
+                       lambda: e.setdefault("C", 2),
+                       e.clear,
+                       lambda: setattr(e, "A", 5),
+                       lambda: setattr(e, "verbose", True),
+                       lambda: delattr(e, "A")):
+            self.assertRaises(TypeError, change)
+        self.assertEqual((dict(e), e.A, e.B), ({"A": 0, "B": 1}, 0, 1))
+
+    def test_pickle(self):
+        tokens = compiler.shared_enums()[0]
+        for protocol in (0, 2):
+            r = pickle.loads(pickle.dumps(tokens, protocol))
+            self.assertEqual(dict(r), dict(tokens))
+            self.assertEqual(r.SYMBOL, tokens.SYMBOL)
+            self.assertRaises(TypeError, r.__setitem__, "NEW", 9)
+        for r in (copy.copy(tokens), copy.deepcopy(tokens)):
+            self.assertEqual(r.get_key_for_value(tokens.EOF), "EOF")
+        e = copy.copy(utils.Enum("A", "B", verbose = True))
+        self.assertEqual((e.A, e.C), ("A", None))
+        e.C = 5 #not frozen
+        self.assertRaises(AttributeError, getattr, e, "__missing_hook__")
+
+    def test_verbose(self):
+        e = utils.Enum("A", "B", verbose = True)
+        self.assertEqual(e.A, "A")
+        self.assertEqual(e.get_key_for_value("B"), "B")
+        e.verbose = False
+        self.assertEqual(e.A, 0)
+
+class TestAutomata(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def test_regex_tables(self):
+        """
+        Longest match wins, ties go to the earlier regex
+        """
+        tables = automata.compile_spec([("kw", "if"), ("id", "[a-z]+"),
+                                        ("num", "[0-9]+(\\.[0-9]+)?")],
+                                        cache_dir = None)
+        def run(text):
+            state = 0
+            for char in text:
+                state = tables.transition[state * tables.num_classes +
+                                          tables.classifier[ord(char)]]
+                if state == automata.ERROR:
+                    return None
+            if tables.accept[state] == automata.ERROR:
+                return None
+            return tables.tokens[tables.accept[state]]
+        self.assertEqual(run("if"), "kw")
+        self.assertEqual(run("iffy"), "id")
+        self.assertEqual(run("3.14"), "num")
+        self.assertEqual(run("3."), None)
+
+    def test_spec_cache(self):
+        spec = [("a", "a+b*")]
+        r = automata.compile_spec(spec, cache_dir = self.cache_dir)
+        self.assertTrue(automata.compile_spec(list(spec)) is r)
+        automata._TABLE_CACHE.clear()
+        r_disk = automata.compile_spec(spec, cache_dir = self.cache_dir)
+        self.assertEqual(r_disk, r)
+        name, = [n for n in os.listdir(self.cache_dir)
+                 if n.endswith(cache.SUFFIX)]
+        with open(os.path.join(self.cache_dir, name), "rb") as fh:
+            self.assertEqual(automata._loads(fh.read()), r) #not a pickle
+
+    def test_prebuilt(self):
+        """
+        The shipped tables match the scanner's token spec
+        """
+        spec = tuple(compiler.Scanner(os.devnull)._token_spec())
+        self.assertEqual(automata._prebuilt(spec), automata._build(spec, ()))
+        self.assertTrue(automata._prebuilt(spec[1:]) is None)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
 class TestParser(unittest.TestCase):
     def setUp(self):
         self.scanner_sheep = compiler.Scanner("test/RRSheepNoise.txt")
@@ -120,9 +267,574 @@ class TestParser(unittest.TestCase):
         r = self.parser_ceg.execute()
         self.assertTrue(r[0] == True)
 
+    def test_ir_without_tree(self):
+        """
+        The parser's own IR matches the one read off the parse tree
+        """
+        for path in ("test/RRSheepNoise.txt", "test/P1.txt",
+                     "test/RRCEG.txt"):
+            s = compiler.Scanner(path)
+            tokens = s.execute()
+            parser = compiler.Parser(tokens, s.bnf_file, build_tree = False)
+            valid, ir = parser.execute()
+            self.assertTrue(valid)
+            g = table_generator.TableGenerator(
+                    compiler.Parser(tokens, s.bnf_file).execute()[1])
+            g.classify_symbols()
+            self.assertEqual(ir, g.IR)
+            self.assertEqual(parser.START, g.START)
+        self.assertEqual(ir["EPrime"][2], ())
+
+    def test_ll1_parser(self):
+        for filename in ("test/RRSheepNoise.txt", "test/P1.txt",
+                         "test/RRCEG.txt", table_generator.BNF_GRAMMAR):
+            r = table_generator.parse_grammar(filename)
+            self.assertTrue(r[0] == True)
+
+    def test_ll1_parser_deep(self):
+        """
+        Long right recursive inputs don't hit the recursion limit
+        """
+        s = self.scanner_sheep
+        tokens = [compiler.Token("A", s.TOKENS.SYMBOL, 1, 0),
+                  compiler.Token(":", s.TOKENS.DERIVES, 1, 0)]
+        tokens += [compiler.Token("a", s.TOKENS.SYMBOL, 1, 0)] * 20000
+        tokens += [compiler.Token(";", s.TOKENS.SEMICOLON, 1, 0),
+                   compiler.Token("", s.TOKENS.EOF, 1, 0)]
+        p = compiler.LL1Parser(table_generator.bnf_table(), tokens,
+                               table_generator.bnf_terminals(s.TOKENS))
+        self.assertTrue(p.execute()[0] == True)
+
+    def test_ll1_parser_error(self):
+        s = self.scanner_sheep
+        tokens = [compiler.Token("A", s.TOKENS.SYMBOL, 1, 0),
+                  compiler.Token(";", s.TOKENS.SEMICOLON, 1, 2),
+                  compiler.Token("", s.TOKENS.EOF, 1, 3)]
+        p = compiler.LL1Parser(table_generator.bnf_table(), tokens,
+                               table_generator.bnf_terminals(s.TOKENS))
+        self.assertRaises(compiler.ParseError, p.execute)
+
+    def test_stream(self):
+        s = compiler.Scanner("test/RRCEG.txt", stream = True)
+        p = compiler.Parser(s.iter_tokens(chunk_size = 16), None)
+        r = p.execute()
+        self.assertTrue(r[0] == True)
+
+    def tearDown(self):
+        return
+
+class TestTableGenerator(unittest.TestCase):
+    def setUp(self):
+        #right recursive classic expression grammar, test/RRCEG.txt
+        self.generator = table_generator.TableGenerator(None)
+        g = self.generator
+        g.IR.update({
+            "Goal": [["Expr"]],
+            "Expr": [["Term", "EPrime"]],
+            "EPrime": [["PLUS", "Term", "EPrime"],
+                       ["MINUS", "Term", "EPrime"], []],
+            "Term": [["Factor", "TPrime"]],
+            "TPrime": [["TIMES", "Factor", "TPrime"],
+                       ["DIV", "Factor", "TPrime"], []],
+            "Factor": [["LP", "Expr", "RP"], ["NUMBER"], ["IDENTIFIER"]]})
+        g.START = "Goal"
+        g.NT = set(g.IR)
+        g.T = set(["PLUS", "MINUS", "TIMES", "DIV", "LP", "RP", "NUMBER",
+                   "IDENTIFIER"])
+        self.EPSILON = g.TOKENS.EPSILON
+        self.EOF = g.TOKENS.EOF
+
+    def test_first_set(self):
+        r = self.generator.first_set()
+        self.assertEqual(r["Goal"], set(["LP", "NUMBER", "IDENTIFIER"]))
+        self.assertEqual(r["EPrime"], set(["PLUS", "MINUS", self.EPSILON]))
+        self.assertEqual(r["TPrime"], set(["TIMES", "DIV", self.EPSILON]))
+
+    def test_parse_table(self):
+        g = self.generator
+        g.first_set()
+        g.follow_set()
+        g.predict_set()
+        r = g.build_table()
+        self.assertEqual(r.conflicts, [])
+        self.assertEqual(r.nonterminals[0], "Goal")
+        eprime = r.nonterminals.index("EPrime")
+        self.assertEqual(r.format_production(
+                            r.lookup(eprime, r.column["PLUS"])),
+                         "EPrime -> PLUS Term EPrime")
+        self.assertEqual(r.format_production(
+                            r.lookup(eprime, r.EOF_COLUMN)),
+                         "EPrime -> epsilon")
+        self.assertEqual(r.lookup(eprime, r.column["NUMBER"]), r.ERROR)
+
+        fh = StringIO.StringIO()
+        r.dump(fh)
+        fh.seek(0)
+        loaded = table_generator.ParseTable.load(fh)
+        self.assertEqual(loaded.table, r.table)
+        self.assertEqual(loaded.productions, r.productions)
+        self.assertEqual(loaded.nonterminals, r.nonterminals)
+        self.assertEqual(loaded.terminals, r.terminals)
+
+    def test_conflicts(self):
+        g = table_generator.TableGenerator(None)
+        g.IR.update({"Goal": [["SheepNoise"]],
+                     "SheepNoise": [["baa", "SheepNoise"], ["baa"]]})
+        g.START = "Goal"
+        g.NT = set(g.IR)
+        g.T = set(["baa"])
+        g.first_set()
+        g.follow_set()
+        g.predict_set()
+        r = g.build_table()
+        self.assertEqual(r.report_conflicts(), ["conflict: SheepNoise on "
+            "baa: SheepNoise -> baa SheepNoise | SheepNoise -> baa"])
+
+        fh = StringIO.StringIO()
+        r.dump(fh)
+        self.assertEqual(table_generator.ParseTable.loads(
+                            fh.getvalue()).conflicts, r.conflicts)
+        self.assertEqual(table_generator.ParseTable.from_dict(
+                            json.loads(json.dumps(r.as_dict()))).conflicts,
+                         r.conflicts)
+
+    def test_dfs_deep(self):
+        """
+        Symbol lists deeper than the recursion limit
+        """
+        g = table_generator.TableGenerator(None)
+        tokens, state = g.TOKENS, g._state
+        symbols = ["s%d" % i for i in xrange(20000)]
+        rest = tree.Node("", state.SYMBOLLIST_P)
+        rest.add_child(tree.Node("", ""))
+        for name in reversed(symbols[1:]):
+            node = tree.Node("", state.SYMBOLLIST_P)
+            node.add_child(tree.Node(name, tokens.SYMBOL))
+            node.add_child(rest)
+            rest = node
+        symbol_list = tree.Node("", state.SYMBOLLIST)
+        symbol_list.add_child(tree.Node(symbols[0], tokens.SYMBOL))
+        symbol_list.add_child(rest)
+        rhs = tree.Node("", state.RIGHTHANDSIDE)
+        rhs.add_child(symbol_list)
+        psp = tree.Node("", state.PRODUCTIONSET_P)
+        psp.add_child(tree.Node("", ""))
+        ps = tree.Node("", state.PRODUCTIONSET)
+        for child in (tree.Node("Goal", tokens.SYMBOL),
+                      tree.Node(":", tokens.DERIVES), rhs, psp):
+            ps.add_child(child)
+        root = tree.Node("", state.PRODUCTIONLIST)
+        root.add_child(ps)
+        g.dfs(root)
+        self.assertEqual(g.IR, {"Goal": [tuple(symbols)]})
+        self.assertEqual(g.START, "Goal")
+
+    def test_update(self):
+        """
+        Patching a table gives the same result as building it again
+        """
+        g = self.generator
+        g.first_set()
+        g.follow_set()
+        g.predict_set()
+        g.build_table()
+        ir = dict((p, [list(e) for e in g.IR[p]]) for p in g.IR)
+        #first and follow sets stay the same, only TPrime is redone
+        ir["TPrime"].insert(2, ["TIMES"])
+        self.assertEqual(g.update(ir), set(["TPrime"]))
+        self.assertEqual(len(g.TABLE.conflicts), 1)
+        #DIV moves into the first set of everything above Factor
+        ir["TPrime"].pop(1)
+        ir["Factor"].append(["DIV"])
+        g.update(ir)
+
+        fresh = table_generator.TableGenerator(None)
+        fresh.update(ir, "Goal")
+        self.assertEqual(g.FIRST_BITS, fresh.FIRST_BITS)
+        self.assertEqual(g.FOLLOW_BITS, fresh.FOLLOW_BITS)
+        self.assertEqual(g.TABLE.table, fresh.TABLE.table)
+        self.assertEqual(g.TABLE.productions, fresh.TABLE.productions)
+        self.assertEqual(g.TABLE.report_conflicts(),
+                         fresh.TABLE.report_conflicts())
+
+    def test_follow_set(self):
+        self.generator.first_set()
+        r = self.generator.follow_set()
+        self.assertEqual(r["Expr"], set(["RP", self.EOF]))
+        self.assertEqual(r["Term"], set(["PLUS", "MINUS", "RP", self.EOF]))
+        self.assertEqual(r["Factor"], set(["PLUS", "MINUS", "TIMES", "DIV",
+                                           "RP", self.EOF]))
+
     def tearDown(self):
         return
 
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = cache.TableCache(self.cache_dir)
+
+    def test_roundtrip(self):
+        key = self.cache.key("grammar", "Goal : a ;")
+        self.assertEqual(self.cache.get(key), None)
+        self.cache.put(key, {"ir": {"Goal": [["a"]]}})
+        self.assertEqual(self.cache.get(key), {"ir": {"Goal": [["a"]]}})
+        self.assertNotEqual(key, self.cache.key("grammar", "Goal : b ;"))
+
+    def test_corrupt_entry(self):
+        key = self.cache.key("broken")
+        self.cache.put(key, [1, 2, 3])
+        with open(os.path.join(self.cache_dir, key + cache.SUFFIX), "wb") as fh:
+            fh.write("\x80\x02garbage")
+        self.assertEqual(self.cache.get(key), None)
+
+    def test_shared_dir(self):
+        """
+        A directory others can write to is neither read nor written
+        """
+        key = self.cache.key("shared")
+        self.assertTrue(self.cache.put(key, [1, 2, 3]))
+        os.chmod(self.cache_dir, 0o777)
+        self.assertEqual(self.cache.get(key), None)
+        self.assertFalse(self.cache.put(key, [4]))
+        os.chmod(self.cache_dir, 0o700)
+        self.assertEqual(self.cache.get(key), [1, 2, 3])
+        fresh = cache.TableCache(os.path.join(self.cache_dir, "new"))
+        self.assertTrue(fresh.put(key, [4]))
+        self.assertEqual(os.stat(fresh.path).st_mode & 0o777, 0o700)
+
+    def test_evict_lru(self):
+        """
+        Entries read recently survive eviction
+        """
+        self.cache.max_size = 3 * 1024
+        keys = [self.cache.key(str(i)) for i in xrange(3)]
+        for i, key in enumerate(keys):
+            self.cache.put(key, "x" * 1000)
+            path = os.path.join(self.cache_dir, key + cache.SUFFIX)
+            os.utime(path, (i, i))
+        self.cache.get(keys[0])
+        self.cache.put(self.cache.key("3"), "x" * 1000)
+        self.assertEqual(self.cache.get(keys[1]), None)
+        self.assertEqual(self.cache.get(keys[0]), "x" * 1000)
+
+    def test_evict_estimate(self):
+        """
+        Writes below max_size do not scan the directory
+        """
+        evictions = []
+        evict = self.cache.evict
+        self.cache.evict = lambda: evictions.append(evict())
+        for i in xrange(10):
+            self.cache.put(self.cache.key(str(i)), "x" * 1000)
+        self.assertEqual(evictions, [])
+        self.cache.max_size = 5 * 1024
+        self.cache.put(self.cache.key("10"), "x" * 1000)
+        self.assertEqual(len(evictions), 1)
+        self.assertTrue(self.cache._size <= self.cache.max_size *
+                        cache.LOW_WATER)
+        self.cache.put(self.cache.key("11"), "x" * 1000)
+        self.assertEqual(len(evictions), 1)
+
+    def test_regenerate(self):
+        path = os.path.join(self.cache_dir, "grammar.txt")
+        shutil.copy("test/RRCEG.txt", path)
+        r = table_generator.regenerate(path, self.cache)
+        self.assertEqual(r.TABLE.table,
+                         table_generator.generate(path).TABLE.table)
+        with open(path) as fh:
+            text = fh.read()
+        for old, new in [("| NUMBER", "| NUMBER\n       | epsilon"),
+                         ("Goal   : Expr", "Goal : Expr Expr"),
+                         ("Term   : Factor TPrime",
+                          "Term : Factor TPrime ;\nUnused : Term")]:
+            text = text.replace(old, new)
+            with open(path, "w") as fh:
+                fh.write(text)
+            r = table_generator.regenerate(path, self.cache)
+            full = table_generator.generate(path)
+            self.assertEqual(r.IR, full.IR)
+            self.assertEqual(r.TABLE.table, full.TABLE.table)
+            self.assertEqual(r.TABLE.conflicts, full.TABLE.conflicts)
+
+    def test_generate(self):
+        r = table_generator.generate("test/RRCEG.txt", self.cache)
+        r_hit = table_generator.generate("test/RRCEG.txt", self.cache)
+        self.assertTrue(r_hit.parse_tree is None)
+        self.assertEqual(r_hit.IR, r.IR)
+        self.assertEqual(r_hit.FOLLOW["Expr"], r.FOLLOW["Expr"])
+        self.assertEqual(r_hit.TABLE.table, r.TABLE.table)
+        self.assertEqual(r_hit.TABLE.productions, r.TABLE.productions)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.bad = os.path.join(self.directory, "bad.txt")
+        with open(self.bad, "w") as fh:
+            fh.write("Goal : a | ;\n")
+
+    def test_expand(self):
+        r = batch.expand(["test/RR*.txt", "test/P1.txt", "test/RRCEG.txt"])
+        self.assertEqual(r, ["test/RRCEG.txt", "test/RRSheepNoise.txt",
+                             "test/P1.txt"])
+        self.assertRaises(ValueError, batch.expand,
+                          ["test/P1.txt", "test/nomatch*.txt"])
+
+    def test_build_all(self):
+        paths = ["test/RRCEG.txt", self.bad, "test/RRSheepNoise.txt"]
+        r = batch.build_all(paths, jobs = 2)
+        self.assertEqual([result.path for result in r], paths)
+        self.assertEqual(r[1].table, None)
+        self.assertTrue(r[1].error.startswith("ParseError: line 1"))
+        table = table_generator.ParseTable.loads(r[0].table)
+        self.assertEqual(table.table,
+                         table_generator.generate(paths[0]).TABLE.table)
+        self.assertEqual(len(r[2].conflicts), 1)
+
+        written = batch.write_tables(r, os.path.join(self.directory, "out"))
+        self.assertEqual([os.path.basename(path) for path in written],
+                         ["RRCEG.ll1", "RRSheepNoise.ll1"])
+
+    def test_name_clash(self):
+        other = os.path.join(self.directory, "RRCEG.txt")
+        shutil.copy("test/RRCEG.txt", other)
+        r = batch.build_all(["test/RRCEG.txt", other], jobs = 1)
+        out = os.path.join(self.directory, "out")
+        self.assertRaises(ValueError, batch.write_tables, r, out)
+        self.assertFalse(os.path.exists(out))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+class TestCodegen(unittest.TestCase):
+    def load(self, grammar):
+        module = {"__name__": "generated"}
+        exec(codegen.generate(grammar), module)
+        return module
+
+    def test_bnf(self):
+        """
+        The generated bnf parser agrees with Scanner and LL1Parser
+        """
+        module = self.load(table_generator.BNF_GRAMMAR)
+        s = compiler.Scanner("test/RRCEG.txt")
+        tokens = s.execute()
+        self.assertEqual(module["tokens"](s.bnf_file), tokens)
+        derivation = compiler.LL1Parser(table_generator.bnf_table(), tokens,
+                            table_generator.bnf_terminals(s.TOKENS)).execute()
+        self.assertEqual(module["parse"](s.bnf_file), list(derivation[1]))
+        self.assertRaises(module["ParseError"], module["parse"],
+                          "Goal : a | ;")
+        self.assertRaises(module["ParseError"], module["parse"], "Goal : $ ;")
+
+    def test_grammar(self):
+        """
+        Terminals that aren't token types are matched by value
+        """
+        module = self.load("test/P1.txt")
+        text = "LParen RParen\nLParen LParen RParen RParen"
+        s = compiler.Scanner("<string>", text = text)
+        table = table_generator.build("test/P1.txt").TABLE
+        derivation = compiler.LL1Parser(table, s.iter_tokens()).execute()
+        self.assertEqual(module["parse"](text), list(derivation[1]))
+        self.assertRaises(module["ParseError"], module["parse"], "LParen")
+
+class TestBenchmark(unittest.TestCase):
+    def test_synthetic_grammar(self):
+        params = dict(benchmark.BASE_CASE, rules = 50, epsilon = 0.5)
+        text = benchmark.synthetic_grammar(**params)
+        self.assertEqual(benchmark.synthetic_grammar(**params), text)
+        self.assertNotEqual(benchmark.synthetic_grammar(seed = 1, **params),
+                            text)
+        generator = table_generator.build("synthetic", text)
+        self.assertEqual(len(generator.NT), 51)
+        self.assertTrue("epsilon" in text)
+
+    def test_compare(self):
+        stages = dict((stage, {"seconds": 0.1, "added_memory_kb": 2048})
+                      for stage in benchmark.STAGES)
+        old = {"cases": {"base": {"params": {}, "stages": stages,
+                                  "peak_memory_kb": 20480}}}
+        new = json.loads(json.dumps(old))
+        self.assertEqual(benchmark.compare(old, new, 1.2)[1], 0)
+        new["cases"]["base"]["stages"]["first"]["seconds"] = 0.2
+        new["cases"]["base"]["stages"]["table"]["added_memory_kb"] = 2100
+        new["cases"]["base"]["peak_memory_kb"] = 21000
+        report, regressions = benchmark.compare(old, new, 1.2)
+        self.assertEqual(regressions, 1)
+        self.assertTrue(report[0].split()[:3] == ["base", "first", "seconds"])
+        new["cases"]["base"]["stages"]["table"]["added_memory_kb"] = 4096
+        new["cases"]["base"]["peak_memory_kb"] = 40960
+        report, regressions = benchmark.compare(old, new, 1.2)
+        self.assertEqual(regressions, 3)
+        self.assertEqual([line.split()[1:3] for line in report[1:3]],
+                         [["table", "added_memory_kb"],
+                          ["-", "peak_memory_kb"]])
+        del old["cases"]["base"]["peak_memory_kb"]
+        for stage in old["cases"]["base"]["stages"].values():
+            del stage["added_memory_kb"]
+        self.assertEqual(benchmark.compare(old, new, 1.2)[1], 1)
+
+    def test_arguments(self):
+        self.assertEqual(benchmark.p.parse_args([]).benchmarks, "all")
+        self.assertEqual(benchmark.p.parse_args(["stages"]).benchmarks,
+                         ["stages"])
+        stderr = sys.stderr
+        sys.stderr = StringIO.StringIO()
+        try:
+            self.assertRaises(SystemExit, benchmark.p.parse_args, ["nosuch"])
+        finally:
+            sys.stderr = stderr
+        self.assertEqual([name for name, _ in benchmark.BENCHMARKS],
+                         benchmark.BENCHMARK_NAMES)
+
+class TestStats(unittest.TestCase):
+    def test_collect(self):
+        self.assertTrue(stats.current() is None)
+        with stats.collect() as collected:
+            s = compiler.Scanner("test/RRCEG.txt")
+            tokens = s.execute()
+            parser = compiler.Parser(tokens, None, build_tree = False)
+            generator = table_generator.TableGenerator.from_ir(
+                                        parser.execute()[1], parser.START)
+            generator.initialize()
+        self.assertTrue(stats.current() is None)
+        self.assertEqual(collected.seconds.keys(), ["scan", "parse", "first",
+                                              "follow", "predict", "table"])
+        counters = collected.counters
+        self.assertEqual(counters["tokens"], len(tokens) - 1)
+        self.assertEqual(counters["dfa_steps"],
+                         sum(len(t.value) for t in tokens))
+        self.assertEqual(counters["parser_calls"], parser.calls)
+        self.assertTrue(counters["first_iterations"] >= len(generator.NT))
+        self.assertTrue(collected.tokens_per_second() > 0)
+        self.assertTrue(collected.peak_memory_kb > 0)
+        self.assertEqual(collected.profile_report(), "")
+
+    def test_build(self):
+        """
+        Tokens pulled through iter_tokens are timed as the scan stage,
+        parser calls are only counted while collecting
+        """
+        with stats.collect() as collected:
+            table_generator.build("test/RRCEG.txt")
+            table_generator.generate("test/RRCEG.txt")
+        self.assertTrue(collected.runs["scan"] >= 2)
+        self.assertTrue(collected.tokens_per_second() > 0)
+        self.assertTrue(collected.counters["parser_calls"] > 0)
+        tokens = compiler.Scanner("test/P1.txt").execute()
+        parser = compiler.Parser(tokens, None, build_tree = False)
+        parser.execute()
+        self.assertEqual(parser.calls, 0)
+        with stats.collect() as collected:
+            parser = compiler.Parser(tokens, None, build_tree = False)
+            parser.calls = 10 ** 6 #reset by execute
+            parser.execute()
+        self.assertTrue(0 < parser.calls < 10 ** 6)
+        self.assertEqual(collected.counters["parser_calls"], parser.calls)
+
+    def test_profile(self):
+        with stats.collect(profile = True) as collected:
+            table_generator.build("test/P1.txt")
+        self.assertTrue("update" in collected.seconds)
+        profiled = pstats.Stats(collected.profiler).stats
+        self.assertTrue("first_bits" in [name for _, _, name in profiled])
+        self.assertTrue(collected.profile_report())
+
+class TestMain(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.output = os.path.join(self.directory, "tables")
+        self.expected = table_generator.generate("test/RRCEG.txt").TABLE
+
+    def run_main(self, *args):
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = StringIO.StringIO(), StringIO.StringIO()
+        try:
+            return table_generator.main(list(args) + ["-o", self.output])
+        finally:
+            self.stdout = sys.stdout.getvalue()
+            self.stderr = sys.stderr.getvalue()
+            sys.stdout, sys.stderr = stdout, stderr
+
+    def test_formats(self):
+        r = self.run_main("-f", "json", "test/RRCEG.txt", "test/P1.txt")
+        self.assertEqual(r, 0)
+        with open(self.output) as fh:
+            lines = [json.loads(line) for line in fh]
+        self.assertEqual([line["grammar"] for line in lines],
+                         ["test/RRCEG.txt", "test/P1.txt"])
+        table = table_generator.ParseTable.from_dict(lines[0])
+        self.assertEqual(table.table, self.expected.table)
+        self.assertEqual(table.productions, self.expected.productions)
+
+        self.run_main("-f", "python", "test/RRCEG.txt")
+        module = {}
+        execfile(self.output, module)
+        table = table_generator.ParseTable.from_dict(
+                                        module["TABLES"]["test/RRCEG.txt"])
+        self.assertEqual(table.table, self.expected.table)
+
+    def test_stdin(self):
+        stdin = sys.stdin
+        with open("test/RRCEG.txt") as fh:
+            sys.stdin = StringIO.StringIO(fh.read())
+        try:
+            self.assertEqual(self.run_main(), 0)
+        finally:
+            sys.stdin = stdin
+        with open(self.output, "rb") as fh:
+            table = table_generator.ParseTable.load(fh)
+        self.assertEqual(table.table, self.expected.table)
+
+    def test_error(self):
+        bad = os.path.join(self.directory, "bad.txt")
+        with open(bad, "w") as fh:
+            fh.write("Goal : a | ;\n")
+        self.assertEqual(self.run_main("-j", "2", "-f", "json", bad,
+                                       "test/P1.txt"), 1)
+        with open(self.output) as fh:
+            lines = [json.loads(line) for line in fh]
+        self.assertEqual([line["grammar"] for line in lines], ["test/P1.txt"])
+
+    def test_invalid_character(self):
+        bad = os.path.join(self.directory, "bad.txt")
+        with open(bad, "w") as fh:
+            fh.write("Goal : a $ b ;\n")
+        self.assertEqual(self.run_main("-f", "json", bad), 1)
+        self.assertEqual(self.stdout, "")
+        self.assertEqual(self.stderr, bad + ": ParseError: line 1: "
+                                      "invalid character '$'\n")
+
+    def test_unmatched_pattern(self):
+        self.assertRaises(SystemExit, self.run_main, "-f", "json",
+                          "test/P1.txt", "test/nomatch*.txt")
+        self.assertTrue("no grammar matches test/nomatch*.txt" in self.stderr)
+        self.assertFalse(os.path.exists(self.output))
+
+    def test_stats_jobs(self):
+        """
+        Workers are not measured, so --stats refuses them
+        """
+        self.assertRaises(SystemExit, self.run_main, "--stats", "-j", "2",
+                          "-f", "json", "test/P1.txt", "test/RRCEG.txt")
+        self.assertEqual(self.run_main("--stats", "-f", "json",
+                                       "test/P1.txt", "test/RRCEG.txt"), 0)
+        self.assertTrue("tokens/s" in self.stderr)
+
+    def test_binary_single(self):
+        """
+        Binary tables carry no names, so several grammars are refused
+        """
+        self.assertRaises(SystemExit, self.run_main, "test/P1.txt",
+                          "test/RRCEG.txt")
+        self.assertFalse(os.path.exists(self.output))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
 if __name__ == "__main__":
     sl = simplelog.sl
     unittest.main()
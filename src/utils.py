@@ -1,12 +1,14 @@
 import collections
-import numpy
 import sys
 
 class Enum(dict):
     """
-    C enum substitute
+    C enum substitute.
+    Members are also plain instance attributes, so self.TOKENS.SYMBOL is a
+    single attribute load, and a value -> key table makes reverse lookups
+    constant time. Members are added by the constructor or by item
+    assignment. A frozen enum raises TypeError on any change.
     """
-    #TODO: get key for value
     def __init__(self, *args, **kwargs):
         """
         Initialize with default start value of 0 but this can be changed
@@ -16,27 +18,121 @@ class Enum(dict):
         verbose - display values by value instead of number
         """
         super(Enum, self).__init__()
-        self.verbose = None
+        self._verbose = None
+        self._keys = {} #value -> key
+        self._frozen = False
 
         if kwargs.has_key("start"):
             start = kwargs["start"]
         else:
             start = 0
-        
-        if kwargs.has_key("verbose"):
-            self.verbose = kwargs["verbose"]
 
         for num, arg in enumerate(args, start):
             self.__setitem__(arg, num)
+        if kwargs.has_key("verbose"):
+            self.verbose = kwargs["verbose"]
+
+    def _check(self):
+        if self.__dict__.get("_frozen"):
+            raise TypeError("enum is frozen")
+
+    def __setitem__(self, key, value):
+        self._check()
+        if key in self:
+            self._keys.pop(self[key], None)
+        super(Enum, self).__setitem__(key, value)
+        self._keys[value] = key
+        self._publish(key)
+
+    def __delitem__(self, key):
+        self._check()
+        self._keys.pop(self[key], None)
+        super(Enum, self).__delitem__(key)
+        if not hasattr(Enum, key):
+            self.__dict__.pop(key, None)
+
+    def __setattr__(self, name, value):
+        self._check()
+        super(Enum, self).__setattr__(name, value)
+
+    def __delattr__(self, name):
+        self._check()
+        super(Enum, self).__delattr__(name)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).iteritems():
+            self[key] = value
+
+    def setdefault(self, key, value = None):
+        if key not in self:
+            self[key] = value
+        return self[key]
+
+    def pop(self, key, *default):
+        if key not in self:
+            self._check()
+            return super(Enum, self).pop(key, *default)
+        value = self[key]
+        del self[key]
+        return value
+
+    def popitem(self):
+        self._check()
+        key, value = super(Enum, self).popitem()
+        super(Enum, self).__setitem__(key, value)
+        del self[key]
+        return key, value
+
+    def clear(self):
+        self._check()
+        for key in self.keys():
+            del self[key]
+
+    def _publish(self, key):
+        """
+        Expose a member as an instance attribute, names of dict methods
+        are left alone
+        """
+        if not hasattr(Enum, key):
+            self.__dict__[key] = key if self._verbose else self[key]
+
+    @property
+    def verbose(self):
+        return self._verbose
+
+    @verbose.setter
+    def verbose(self, verbose):
+        self._check()
+        self._verbose = verbose
+        for key in self:
+            self._publish(key)
+
+    def freeze(self):
+        """
+        Disallow changes, for enums shared between objects
+        @return:
+        self
+        """
+        self.__dict__["_frozen"] = True
+        return self
 
     def __getattr__(self, name):
         """
-        Return attribute if it exists in the dictionary
+        Only reached for names that aren't members, which are None.
+        Private and special names raise AttributeError, so pickle and
+        copy don't take None for their hooks.
         """
-        if self.__contains__(name):
-            if (self.verbose):
-                return self.get_key_for_key(name)
-            return self.__getitem__(name)
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return None
+
+    def __reduce__(self):
+        """
+        Pickle and copy through the constructor, item assignment would
+        run into the check of a frozen enum
+        """
+        return (_enum, (dict(self), self._verbose,
+                        self.__dict__.get("_frozen", False)))
 
     def get_key_for_key(self, key):
         """
@@ -53,15 +149,70 @@ class Enum(dict):
         >>> t = Enum("A", "B", "C")
         >>> t.get_key_for_value(1)
         'B'
+        >>> t.B
+        1
         >>> t.verbose = True
         >>> t.A
         'A'
         """
         if (self.verbose):
             return self.get_key_for_key(value)
-        else:
-            return filter(lambda x: x[1] == value, self.items())[0][0]
-    
+        try:
+            return self._keys[value]
+        except KeyError:
+            raise IndexError("no key for value {0!r}".format(value))
+
+def _enum(members, verbose, frozen):
+    """
+    Rebuild an Enum pickled or copied by Enum.__reduce__
+    """
+    enum = Enum()
+    for key, value in members.iteritems():
+        enum[key] = value
+    if verbose is not None:
+        enum.verbose = verbose
+    if frozen:
+        enum.freeze()
+    return enum
+
+class BitSets(collections.Mapping):
+    """
+    Read only mapping of keys to sets stored as integer bitmasks.
+    Bit i stands for universe[i], sets are decoded on access.
+    """
+    def __init__(self, bits, universe):
+        """
+        @param:
+        bits - dict of key -> int bitmask
+        universe - list of elements, indexed by bit position
+        """
+        self.bits = bits
+        self.universe = universe
+
+    def __getitem__(self, key):
+        return decode_bits(self.bits[key], self.universe)
+
+    def __iter__(self):
+        return iter(self.bits)
+
+    def __len__(self):
+        return len(self.bits)
+
+
+def decode_bits(bits, universe):
+    """
+    Turn an integer bitmask into the set of elements it stands for
+    >>> sorted(decode_bits(5, ["a", "b", "c"]))
+    ['a', 'c']
+    """
+    result = set()
+    while bits:
+        low = bits & -bits
+        result.add(universe[low.bit_length() - 1])
+        bits ^= low
+    return result
+
+
 def bfs(g, startnode, **kwargs):
     """
     Implement bfs algo. Explore graph in first in first out fashion.